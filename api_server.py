@@ -1,373 +1,1230 @@
-from flask import Flask, request, jsonify, send_file
-from flask_cors import CORS
-import tempfile
+from fastapi import FastAPI, File, Form, Request, UploadFile
+from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import FileResponse, JSONResponse, Response, StreamingResponse
+from starlette.background import BackgroundTask
+from typing import List, Optional
+from urllib.parse import quote
+from streaming_form_data import StreamingFormDataParser
+from streaming_form_data.targets import FileTarget, ValueTarget
+from zipstream import ZipStream, ZIP_STORED
+import aiofiles
+import aiofiles.os
+import asyncio
+import functools
+import gc
 import os
 import time
-import base64
-import threading
+import uuid
+import shutil
+import sqlite3
 import queue
 import logging
+import argparse
+import uvicorn
 from werkzeug.utils import secure_filename
-from musetalk_wrapper import MuseTalkWrapper
+try:
+    from blake3 import blake3 as content_hash  # SIMD-accelerated
+except ImportError:
+    from hashlib import blake2b as content_hash
+from musetalk_wrapper import MuseTalkWrapper, SCRATCH_DIR, new_scratch_dir, release_cuda_cache
+from musetalk_worker import get_worker_pool, shutdown_worker_pools
 
-app = Flask(__name__)
-CORS(app)  # Enable CORS for web clients
+app = FastAPI(title="MuseTalk API Server")
+app.add_middleware(  # Enable CORS for web clients
+    CORSMiddleware,
+    allow_origins=["*"],
+    allow_methods=["*"],
+    allow_headers=["*"]
+)
 
 # Configure logging
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
-# Global storage for avatars and processing queues
+# Global storage for avatars and processing queues. Avatars are recorded in the
+# avatar database; this holds the wrappers built for them in this process
 avatars = {}
 processing_queues = {}
 
+# Video generation tasks submitted through /generate_video, keyed by task id
+TASKS = {}
+# Seconds a finished task's result is kept if the client never fetches it
+TASK_RESULT_TTL = 3600
+
+# Chunked avatar uploads in progress, keyed by upload id
+avatar_uploads = {}
+# Recommended chunk size for chunked uploads
+CHUNKED_UPLOAD_CHUNK_SIZE = 16 << 20
+# Seconds an abandoned chunked upload is kept before its parts are removed
+CHUNKED_UPLOAD_TTL = 24 * 3600
+
+# Internal nginx location mapped onto SCRATCH_DIR (e.g. /internal/scratch/). When set,
+# generated videos are handed to nginx with X-Accel-Redirect instead of being sent by Python
+ACCEL_REDIRECT_PREFIX = os.environ.get('MUSETALK_ACCEL_REDIRECT')
+# Seconds a file handed to nginx is kept, so it has been opened before removal
+ACCEL_REDIRECT_GRACE = 60
+
+# Generated videos keyed by avatar and audio content, so repeated requests skip inference
+OUTPUT_CACHE_DIR = os.path.join(SCRATCH_DIR, 'outputs')
+# The cache lives in SCRATCH_DIR (tmpfs, i.e. RAM, by default), so it is bounded: entries
+# unused for OUTPUT_CACHE_TTL seconds are evicted, then the least recently used ones
+# until the cache fits in OUTPUT_CACHE_MAX_BYTES
+OUTPUT_CACHE_MAX_BYTES = int(os.environ.get('MUSETALK_OUTPUT_CACHE_MB', 1024)) << 20
+OUTPUT_CACHE_TTL = int(os.environ.get('MUSETALK_OUTPUT_CACHE_TTL', 24 * 3600))
+# Pruning scans the whole cache, so it runs in a thread at most this often (seconds)
+OUTPUT_CACHE_PRUNE_INTERVAL = 60
+
+# Uploads are copied to disk in chunks of this size
+UPLOAD_CHUNK_SIZE = 1 << 20
+
+# Reusable write buffers for streamed uploads, so steady upload traffic does not
+# allocate and free a fresh megabyte for every request
+UPLOAD_BUF_COUNT = 8
+UPLOAD_BUF_POOL = queue.SimpleQueue()
+for _ in range(UPLOAD_BUF_COUNT):
+    UPLOAD_BUF_POOL.put(bytearray(UPLOAD_CHUNK_SIZE))
+
+def acquire_upload_buffer():
+    try:
+        return UPLOAD_BUF_POOL.get_nowait()
+    except queue.Empty:
+        # Pool exhausted by concurrent uploads; fall back to a one-off buffer
+        return bytearray(UPLOAD_CHUNK_SIZE)
+
+def release_upload_buffer(buf):
+    if UPLOAD_BUF_POOL.qsize() < UPLOAD_BUF_COUNT:
+        UPLOAD_BUF_POOL.put(buf)
+
 class APIServer:
     """
     HTTP API Server for MuseTalk streaming.
     Provides REST endpoints for avatar initialization and video generation.
     """
-    
+
     def __init__(self):
-        self.upload_folder = tempfile.mkdtemp(prefix="musetalk_api_uploads_")
-        self.output_folder = tempfile.mkdtemp(prefix="musetalk_api_outputs_")
-        
+        # Uploads, per-request outputs and wrapper temp dirs all live under the shared
+        # scratch dir, so files move between them with a rename instead of a copy.
+        # Each request gets its own subdirectory of output_folder, removed once the
+        # response has been sent.
+        self.upload_folder = os.path.join(SCRATCH_DIR, "uploads")
+        self.output_folder = os.path.join(SCRATCH_DIR, "requests")
+
+        # The avatar database and the source videos its avatars were prepared from must
+        # survive a reboot, so they live on disk (beside the prepared data in results/)
+        # rather than in the scratch dir, which is tmpfs by default
+        self.data_folder = os.path.abspath(os.environ.get('MUSETALK_DATA_DIR', os.path.join("results", "api")))
+        self.avatar_video_folder = os.path.join(self.data_folder, "avatar_videos")
+
         # Ensure folders exist
         os.makedirs(self.upload_folder, exist_ok=True)
         os.makedirs(self.output_folder, exist_ok=True)
-        
+        os.makedirs(self.avatar_video_folder, exist_ok=True)
+
         logger.info(f"API Server initialized")
         logger.info(f"Upload folder: {self.upload_folder}")
         logger.info(f"Output folder: {self.output_folder}")
+        logger.info(f"Data folder: {self.data_folder}")
 
 api_server = APIServer()
 
-@app.route('/health', methods=['GET'])
-def health_check():
+# Prepared avatars survive restarts and are shared by all server processes
+AVATAR_DB = os.path.join(api_server.data_folder, 'avatars.db')
+
+def avatar_db():
+    conn = sqlite3.connect(AVATAR_DB, timeout=10)
+    conn.row_factory = sqlite3.Row
+    return conn
+
+with avatar_db() as conn:
+    conn.execute('PRAGMA journal_mode=WAL')
+    conn.execute(
+        'CREATE TABLE IF NOT EXISTS avatars ('
+        'avatar_id TEXT PRIMARY KEY, video_path TEXT, version TEXT, prep_dir TEXT, ctime REAL)'
+    )
+conn.close()
+
+def save_avatar(avatar_id, wrapper):
+    conn = avatar_db()
+    with conn:
+        conn.execute(
+            'INSERT OR REPLACE INTO avatars VALUES (?, ?, ?, ?, ?)',
+            (avatar_id, wrapper.avatar_video_path, wrapper.version, wrapper.prep_dir, time.time())
+        )
+    conn.close()
+
+def release_avatar_video(video_path):
+    """Delete an avatar source video once no avatar in the database is prepared from it"""
+    conn = avatar_db()
+    referenced = conn.execute('SELECT 1 FROM avatars WHERE video_path = ? LIMIT 1', (video_path,)).fetchone()
+    conn.close()
+    if referenced is None:
+        try:
+            os.remove(video_path)
+        except FileNotFoundError:
+            pass
+
+def load_avatars(avatar_id=None):
+    """Rows of the avatar database, or only the row for avatar_id"""
+    conn = avatar_db()
+    if avatar_id is None:
+        rows = conn.execute('SELECT * FROM avatars ORDER BY ctime').fetchall()
+    else:
+        rows = conn.execute('SELECT * FROM avatars WHERE avatar_id = ?', (avatar_id,)).fetchall()
+    conn.close()
+    return rows
+
+def remove_avatar(avatar_id):
+    conn = avatar_db()
+    with conn:
+        conn.execute('DELETE FROM avatars WHERE avatar_id = ?', (avatar_id,))
+    conn.close()
+
+def get_avatar(avatar_id):
+    """
+    Wrapper for a prepared avatar, or None if it does not exist.
+    Avatars prepared before a restart or by another server process are rebuilt
+    from the avatar database on first use, reusing their prepared data.
+    """
+    rows = load_avatars(avatar_id)
+    if not rows:
+        # Deleted, possibly by another server process
+        avatars.pop(avatar_id, None)
+        processing_queues.pop(avatar_id, None)
+        return None
+
+    wrapper = avatars.get(avatar_id)
+    if wrapper is None:
+        row = rows[0]
+        try:
+            wrapper = MuseTalkWrapper(
+                avatar_video_path=row['video_path'],
+                musetalk_project_path=".",
+                version=row['version'],
+                prepared_dir=row['prep_dir']
+            )
+        except FileNotFoundError as e:
+            logger.error(f"Cannot restore avatar {avatar_id}: {e}")
+            return None
+
+        avatars[avatar_id] = wrapper
+        processing_queues[avatar_id] = queue.Queue()
+    return wrapper
+
+# Rendered responses of read-only polling endpoints, keyed by endpoint name
+response_cache = {}
+
+def cached(timeout=2):
+    """
+    Serve an endpoint's rendered JSON from memory for `timeout` seconds.
+    Error responses are not cached.
+    """
+    def decorator(func):
+        @functools.wraps(func)
+        async def wrapper():
+            now = time.monotonic()
+            hit = response_cache.get(func.__name__)
+            if hit is not None and now - hit[0] < timeout:
+                return hit[1]
+
+            response = await func()
+            if isinstance(response, dict):
+                response = JSONResponse(response)
+                response_cache[func.__name__] = (now, response)
+            return response
+        return wrapper
+    return decorator
+
+def invalidate_cache(*names):
+    for name in names:
+        response_cache.pop(name, None)
+
+@app.on_event('startup')
+async def start_workers():
+    """Start the default (v15) inference workers so the first request skips model loading"""
+    if int(os.environ.get('MUSETALK_CONCURRENCY', 1)) > 0:
+        get_worker_pool(".", "v15")
+
+@app.on_event('shutdown')
+async def stop_workers():
+    shutdown_worker_pools()
+
+async def async_save(source, path, hasher=None):
+    """
+    Write an UploadFile or an async iterable of byte chunks (e.g. request.stream())
+    to disk without blocking the event loop or holding the whole file in memory.
+    The content is fed to hasher as it is written, if one is given.
+    """
+    async with aiofiles.open(path, 'wb') as f:
+        if hasattr(source, 'read'):
+            while True:
+                chunk = await source.read(UPLOAD_CHUNK_SIZE)
+                if not chunk:
+                    break
+                if hasher is not None:
+                    hasher.update(chunk)
+                await f.write(chunk)
+        else:
+            async for block in coalesce_chunks(source):
+                if hasher is not None:
+                    hasher.update(block)
+                await f.write(block)
+
+async def coalesce_chunks(source):
+    """
+    Gather the small chunks the server hands over (tens of KiB each) into a pooled
+    UPLOAD_CHUNK_SIZE buffer and yield it whenever it fills up, then once more for
+    the remainder. Each yielded memoryview is only valid until the next is requested.
+    """
+    buf = acquire_upload_buffer()
+    view = memoryview(buf)
+    filled = 0
+    try:
+        async for chunk in source:
+            data = memoryview(chunk)
+            while data:
+                n = min(len(data), len(buf) - filled)
+                view[filled:filled + n] = data[:n]
+                filled += n
+                data = data[n:]
+                if filled == len(buf):
+                    yield view
+                    filled = 0
+        if filled:
+            yield view[:filled]
+    finally:
+        view.release()
+        release_upload_buffer(buf)
+
+class HashingFileTarget(FileTarget):
+    """FileTarget that also hashes the file content as it is written"""
+
+    def __init__(self, filename, hasher):
+        super().__init__(filename)
+        self.hasher = hasher
+
+    def on_data_received(self, chunk):
+        self.hasher.update(chunk)
+        super().on_data_received(chunk)
+
+def upload_digest(hasher):
+    """Short content digest used to name uploads and cached outputs"""
+    return hasher.hexdigest()[:16]
+
+async def parse_streaming_upload(request, file_field, value_fields, folder):
+    """
+    Parse a multipart request body incrementally, writing file_field straight to disk.
+
+    The file lands under a temporary name in folder first because form values (e.g.
+    avatar_id) may arrive after the file part; callers rename it once the whole body is read.
+
+    Returns:
+    - (partial_path, client filename or None, dict of decoded form values, content digest)
+    """
+    parser = StreamingFormDataParser(headers=request.headers)
+
+    partial_path = os.path.join(folder, f".upload_{uuid.uuid4().hex}")
+    hasher = content_hash()
+    file_target = HashingFileTarget(partial_path, hasher)
+    parser.register(file_field, file_target)
+
+    value_targets = {}
+    for name in value_fields:
+        value_targets[name] = ValueTarget()
+        parser.register(name, value_targets[name])
+
+    # The parser writes the file part synchronously, so feed it off the event loop,
+    # a whole buffer per thread hop
+    async for block in coalesce_chunks(request.stream()):
+        await asyncio.to_thread(parser.data_received, bytes(block))
+
+    values = {name: target.value.decode() or None for name, target in value_targets.items()}
+    return partial_path, file_target.multipart_filename, values, upload_digest(hasher)
+
+async def receive_upload(request, file_field, value_fields, default_filename, folder=None):
+    """
+    Receive an upload either as multipart/form-data or, preferably for large files,
+    as a raw application/octet-stream body.
+
+    Raw uploads carry their parameters in the query string or as X-<Name> headers
+    (e.g. ?avatar_id=me or X-Avatar-Id: me) and the client filename as `filename`.
+    The body is written straight to disk as it arrives, into folder (the upload
+    folder by default) so the caller can rename it into place on the same filesystem.
+
+    Returns:
+    - (partial_path, client filename or None, dict of form values, content digest)
+    """
+    folder = folder or api_server.upload_folder
+    content_type = request.headers.get('content-type', '')
+    if not content_type.startswith('application/octet-stream'):
+        return await parse_streaming_upload(request, file_field, value_fields, folder)
+
+    def param(name):
+        return request.query_params.get(name) or request.headers.get(f"x-{name.replace('_', '-')}")
+
+    partial_path = os.path.join(folder, f".upload_{uuid.uuid4().hex}")
+    hasher = content_hash()
+    await async_save(request.stream(), partial_path, hasher)
+
+    values = {name: param(name) for name in value_fields}
+    return partial_path, param('filename') or default_filename, values, upload_digest(hasher)
+
+async def read_params(request):
+    """Parameters of a small JSON or form-encoded request body"""
+    if request.headers.get('content-type', '').startswith('application/json'):
+        return await request.json()
+    return await request.form()
+
+def chunk_path(upload_id, index):
+    return os.path.join(api_server.upload_folder, f"{upload_id}.part{index}")
+
+def concat_chunks(upload_id, count, path, hasher):
+    """Join the chunks of an upload into path in order, hashing the content on the way"""
+    buf = acquire_upload_buffer()
+    view = memoryview(buf)
+    try:
+        with open(path, 'wb') as out:
+            for index in range(count):
+                part = chunk_path(upload_id, index)
+                with open(part, 'rb', buffering=0) as src:
+                    while n := src.readinto(buf):
+                        hasher.update(view[:n])
+                        out.write(view[:n])
+                os.remove(part)
+    finally:
+        view.release()
+        release_upload_buffer(buf)
+
+def remove_chunks(upload_id, indices):
+    for index in indices:
+        try:
+            os.remove(chunk_path(upload_id, index))
+        except FileNotFoundError:
+            pass
+
+def discard_chunked_upload(upload_id):
+    upload = avatar_uploads.pop(upload_id)
+    remove_chunks(upload_id, upload['received'])
+
+def store_upload(partial_path, digest, filename):
+    """
+    Move a received avatar video to its final path, named after its content so
+    re-uploads of the same file share one copy, and return that path
+    """
+    extension = os.path.splitext(secure_filename(filename))[1]
+    path = os.path.join(api_server.avatar_video_folder, f"{digest}{extension}")
+    if os.path.exists(path):
+        discard_upload(partial_path)
+    else:
+        os.replace(partial_path, path)
+    return path
+
+def prune_chunked_uploads():
+    """Drop chunked uploads that have not received data for CHUNKED_UPLOAD_TTL"""
+    now = time.time()
+    for upload_id, upload in list(avatar_uploads.items()):
+        if now - upload['updated_at'] > CHUNKED_UPLOAD_TTL:
+            discard_chunked_upload(upload_id)
+
+# Strong references to fire-and-forget tasks so they are not garbage collected
+background_tasks = set()
+
+async def remove_file(path):
+    try:
+        await aiofiles.os.remove(path)
+    except FileNotFoundError:
+        pass
+
+def remove_request_dir(path):
+    """Remove a request's scratch directory; run after its response has been sent"""
+    shutil.rmtree(path, ignore_errors=True)
+
+def send_video(video_path, output_name, request_dir):
+    """
+    Response for a generated video; request_dir is removed once it has been sent.
+    Uses X-Accel-Redirect when ACCEL_REDIRECT_PREFIX is set, otherwise FileResponse.
+    """
+    filename = f"{output_name}.mp4"
+    if not ACCEL_REDIRECT_PREFIX:
+        return FileResponse(
+            video_path,
+            filename=filename,
+            media_type='video/mp4',
+            background=BackgroundTask(remove_request_dir, request_dir)
+        )
+
+    # nginx reads the file after this response completes, so removal is deferred
+    location = ACCEL_REDIRECT_PREFIX.rstrip('/') + '/' + os.path.relpath(video_path, SCRATCH_DIR)
+    asyncio.get_running_loop().call_later(ACCEL_REDIRECT_GRACE, remove_request_dir, request_dir)
+    return Response(
+        media_type='video/mp4',
+        headers={
+            'X-Accel-Redirect': quote(location),
+            'Content-Disposition': f'attachment; filename="{filename}"'
+        }
+    )
+
+def output_cache_dir(avatar_id):
+    # Keyed on a digest of the raw id: sanitized ids can collide or come out empty
+    return os.path.join(OUTPUT_CACHE_DIR, content_hash(avatar_id.encode()).hexdigest()[:32])
+
+def output_cache_path(avatar_id, digest):
+    return os.path.join(output_cache_dir(avatar_id), f"{digest}.mp4")
+
+def clear_output_cache(avatar_id):
+    shutil.rmtree(output_cache_dir(avatar_id), ignore_errors=True)
+
+def prune_output_cache():
+    """Evict expired cached videos, then the least recently used until the cache fits"""
+    entries = []
+    now = time.time()
+    for cache_dir in os.scandir(OUTPUT_CACHE_DIR):
+        if not cache_dir.is_dir():
+            continue
+        try:
+            cache_entries = list(os.scandir(cache_dir.path))
+        except FileNotFoundError:
+            # Cleared for a deleted or re-initialized avatar meanwhile
+            continue
+        for entry in cache_entries:
+            try:
+                stat = entry.stat()
+            except FileNotFoundError:
+                continue
+            if now - stat.st_mtime > OUTPUT_CACHE_TTL:
+                discard_cached(entry.path)
+            else:
+                entries.append((stat.st_mtime, stat.st_size, entry.path))
+
+    total = sum(size for _, size, _ in entries)
+    for _, size, path in sorted(entries):
+        if total <= OUTPUT_CACHE_MAX_BYTES:
+            break
+        discard_cached(path)
+        total -= size
+
+last_output_cache_prune = 0.0
+
+def schedule_output_cache_prune():
+    """Prune the output cache in a worker thread, at most every OUTPUT_CACHE_PRUNE_INTERVAL"""
+    global last_output_cache_prune
+    now = time.monotonic()
+    if now - last_output_cache_prune < OUTPUT_CACHE_PRUNE_INTERVAL:
+        return
+    last_output_cache_prune = now
+
+    task = asyncio.create_task(asyncio.to_thread(prune_output_cache))
+    background_tasks.add(task)
+    task.add_done_callback(background_tasks.discard)
+
+def discard_cached(path):
+    # Requests holding a hard link to the video keep their copy
+    try:
+        os.unlink(path)
+    except FileNotFoundError:
+        pass
+
+def cached_video(cache_path, request_dir, output_name):
+    """Link a previously generated video into request_dir; None on a cache miss"""
+    video_path = os.path.join(request_dir, f"{output_name}.mp4")
+    try:
+        os.link(cache_path, video_path)
+    except FileNotFoundError:
+        return None
+    # The modification time doubles as the last use, for eviction
+    os.utime(cache_path)
+    return video_path
+
+def cache_video(video_path, cache_path):
+    os.makedirs(os.path.dirname(cache_path), exist_ok=True)
+    partial_path = f"{cache_path}.{uuid.uuid4().hex}"
+    os.link(video_path, partial_path)
+    os.replace(partial_path, cache_path)
+    os.utime(cache_path)
+    schedule_output_cache_prune()
+
+async def run_generation(wrapper, audio_path, output_name, request_dir, cache_path):
+    """Generate one video into request_dir, raising if nothing was produced"""
+    video_path = cached_video(cache_path, request_dir, output_name)
+    if video_path:
+        logger.info(f"Serving cached video for audio: {audio_path}")
+        return video_path
+
+    video_path = await wrapper.generate_video_from_audio_async(audio_path, output_name, result_dir=request_dir)
+    if not video_path or not os.path.exists(video_path):
+        raise RuntimeError('Failed to generate video')
+
+    cache_video(video_path, cache_path)
+    return video_path
+
+def finish_task(record, task):
+    record['finished_at'] = time.time()
+    if not task.cancelled() and task.exception() is not None:
+        logger.error(f"Task {record['task_id']} failed: {task.exception()}")
+
+def prune_tasks():
+    """Drop finished tasks whose results were never fetched"""
+    now = time.time()
+    for task_id, record in list(TASKS.items()):
+        finished_at = record.get('finished_at')
+        if finished_at is not None and now - finished_at > TASK_RESULT_TTL:
+            remove_request_dir(record['request_dir'])
+            del TASKS[task_id]
+
+def discard_upload(path):
+    """Delete a file in the background; the caller does not wait for the unlink"""
+    task = asyncio.create_task(remove_file(path))
+    background_tasks.add(task)
+    task.add_done_callback(background_tasks.discard)
+
+@app.get('/health')
+@cached(timeout=2)
+async def health_check():
     """Health check endpoint"""
-    return jsonify({
+    return {
         'status': 'healthy',
         'message': 'MuseTalk API Server is running',
         'timestamp': time.time()
-    })
+    }
 
-@app.route('/initialize_avatar', methods=['POST'])
-def initialize_avatar():
+@app.post('/initialize_avatar')
+async def initialize_avatar(request: Request):
     """
     Initialize an avatar for video generation.
-    
+
     Expected form data:
     - avatar_video: Video file (multipart/form-data)
     - avatar_id: Optional avatar identifier
     - version: Optional MuseTalk version (v1 or v15, default: v15)
-    
+
+    Large videos should instead be sent as an application/octet-stream body,
+    with avatar_id, version and filename in the query string or X-* headers.
+
     Returns:
     - JSON response with avatar_id and status
     """
     try:
+        # Stream the upload to disk while parsing the form
+        partial_path, video_filename, form, digest = await receive_upload(
+            request, 'avatar_video', ['avatar_id', 'version'], 'avatar_video.mp4',
+            folder=api_server.avatar_video_folder
+        )
+
         # Check if video file is provided
-        if 'avatar_video' not in request.files:
-            return jsonify({'error': 'No avatar video file provided'}), 400
-        
-        video_file = request.files['avatar_video']
-        if video_file.filename == '':
-            return jsonify({'error': 'No video file selected'}), 400
-        
+        if video_filename is None:
+            discard_upload(partial_path)
+            return JSONResponse({'error': 'No avatar video file provided'}, status_code=400)
+
+        if video_filename == '':
+            discard_upload(partial_path)
+            return JSONResponse({'error': 'No video file selected'}, status_code=400)
+
         # Get optional parameters
-        avatar_id = request.form.get('avatar_id', f'avatar_{int(time.time())}')
-        version = request.form.get('version', 'v15')
-        
+        avatar_id = form['avatar_id'] or f'avatar_{int(time.time())}'
+        version = form['version'] or 'v15'
+
         if version not in ['v1', 'v15']:
-            return jsonify({'error': 'Invalid version. Must be v1 or v15'}), 400
-        
-        # Save uploaded video
-        filename = secure_filename(video_file.filename)
-        video_path = os.path.join(api_server.upload_folder, f"{avatar_id}_{filename}")
-        video_file.save(video_path)
-        
-        logger.info(f"Initializing avatar {avatar_id} with video: {video_path}")
-        
+            discard_upload(partial_path)
+            return JSONResponse({'error': 'Invalid version. Must be v1 or v15'}, status_code=400)
+
+        video_path = store_upload(partial_path, digest, video_filename)
+        return await create_avatar(avatar_id, version, video_path)
+
+    except Exception as e:
+        logger.error(f"Error initializing avatar: {e}")
+        return JSONResponse({
+            'status': 'error',
+            'message': f'Avatar initialization failed: {str(e)}'
+        }, status_code=500)
+
+async def create_avatar(avatar_id, version, video_path):
+    """Prepare an uploaded avatar video and register the avatar"""
+    logger.info(f"Initializing avatar {avatar_id} with video: {video_path}")
+
+    try:
         # Initialize avatar wrapper
         wrapper = MuseTalkWrapper(
             avatar_video_path=video_path,
             musetalk_project_path=".",
             version=version
         )
-        
+
         # Prepare avatar (this may take some time)
-        success = wrapper.prepare_avatar_realtime()
-        
-        if success:
-            avatars[avatar_id] = wrapper
-            processing_queues[avatar_id] = queue.Queue()
-            
-            logger.info(f"Avatar {avatar_id} initialized successfully")
-            
-            return jsonify({
-                'status': 'success',
-                'avatar_id': avatar_id,
-                'message': 'Avatar initialized successfully',
-                'version': version
-            })
-        else:
-            return jsonify({
-                'status': 'error',
-                'message': 'Failed to initialize avatar'
-            }), 500
-    
+        success = await wrapper.prepare_avatar_realtime_async()
+    except Exception:
+        release_avatar_video(os.path.abspath(video_path))
+        raise
+
+    if success:
+        # Re-initializing an existing avatar replaces its wrapper and prepared data
+        old_wrapper = avatars.pop(avatar_id, None)
+        old_rows = load_avatars(avatar_id)
+
+        avatars[avatar_id] = wrapper
+        processing_queues[avatar_id] = queue.Queue()
+        save_avatar(avatar_id, wrapper)
+
+        if old_wrapper is not None:
+            old_wrapper.cleanup()
+        for row in old_rows:
+            if row['prep_dir'] and os.path.abspath(row['prep_dir']) != os.path.abspath(wrapper.prep_dir):
+                shutil.rmtree(row['prep_dir'], ignore_errors=True)
+            release_avatar_video(row['video_path'])
+        # Videos cached for an earlier avatar with the same id are stale
+        clear_output_cache(avatar_id)
+        invalidate_cache('list_avatars', 'get_status')
+
+        logger.info(f"Avatar {avatar_id} initialized successfully")
+
+        return {
+            'status': 'success',
+            'avatar_id': avatar_id,
+            'message': 'Avatar initialized successfully',
+            'version': version
+        }
+    else:
+        release_avatar_video(wrapper.avatar_video_path)
+        return JSONResponse({
+            'status': 'error',
+            'message': 'Failed to initialize avatar'
+        }, status_code=500)
+
+@app.post('/initialize_avatar/start')
+async def start_chunked_upload(request: Request):
+    """
+    Start a chunked, resumable avatar video upload.
+
+    Expected JSON or form data:
+    - avatar_id: Optional avatar identifier
+    - version: Optional MuseTalk version (v1 or v15, default: v15)
+    - filename: Optional video filename
+
+    Returns:
+    - JSON response with upload_id and the recommended chunk_size. Send each chunk
+      with PUT /initialize_avatar/chunk, then call POST /initialize_avatar/complete
+    """
+    try:
+        params = await read_params(request)
+        avatar_id = params.get('avatar_id') or f'avatar_{int(time.time())}'
+        version = params.get('version') or 'v15'
+
+        if version not in ['v1', 'v15']:
+            return JSONResponse({'error': 'Invalid version. Must be v1 or v15'}, status_code=400)
+
+        prune_chunked_uploads()
+        upload_id = uuid.uuid4().hex
+        avatar_uploads[upload_id] = {
+            'avatar_id': avatar_id,
+            'version': version,
+            'filename': secure_filename(params.get('filename') or 'avatar_video.mp4'),
+            'received': set(),
+            'updated_at': time.time()
+        }
+
+        return {
+            'status': 'success',
+            'upload_id': upload_id,
+            'avatar_id': avatar_id,
+            'chunk_size': CHUNKED_UPLOAD_CHUNK_SIZE
+        }
+
     except Exception as e:
-        logger.error(f"Error initializing avatar: {e}")
-        return jsonify({
+        logger.error(f"Error starting chunked upload: {e}")
+        return JSONResponse({
+            'status': 'error',
+            'message': f'Failed to start upload: {str(e)}'
+        }, status_code=500)
+
+@app.put('/initialize_avatar/chunk')
+async def upload_chunk(request: Request, upload_id: str, index: int):
+    """
+    Receive one chunk of a chunked upload as the raw request body.
+    Chunks may arrive in any order or in parallel; re-sending a chunk replaces it.
+    """
+    try:
+        upload = avatar_uploads.get(upload_id)
+        if upload is None:
+            return JSONResponse({'error': f'Upload {upload_id} not found'}, status_code=404)
+
+        if index < 0:
+            return JSONResponse({'error': 'index must not be negative'}, status_code=400)
+
+        # Only count the chunk once it has been received completely
+        part = chunk_path(upload_id, index)
+        await async_save(request.stream(), f"{part}.tmp")
+        os.replace(f"{part}.tmp", part)
+
+        upload['received'].add(index)
+        upload['updated_at'] = time.time()
+
+        return {
+            'status': 'success',
+            'upload_id': upload_id,
+            'index': index
+        }
+
+    except Exception as e:
+        logger.error(f"Error receiving chunk {index} of upload {upload_id}: {e}")
+        return JSONResponse({
+            'status': 'error',
+            'message': f'Failed to receive chunk: {str(e)}'
+        }, status_code=500)
+
+@app.get('/initialize_avatar/status')
+async def chunked_upload_status(upload_id: str):
+    """List the chunks received so far, so an interrupted upload can resume"""
+    upload = avatar_uploads.get(upload_id)
+    if upload is None:
+        return JSONResponse({'error': f'Upload {upload_id} not found'}, status_code=404)
+
+    return {
+        'status': 'success',
+        'upload_id': upload_id,
+        'avatar_id': upload['avatar_id'],
+        'received': sorted(upload['received'])
+    }
+
+@app.post('/initialize_avatar/complete')
+async def complete_chunked_upload(request: Request):
+    """
+    Assemble a chunked upload and initialize the avatar from it.
+
+    Expected JSON or form data:
+    - upload_id: Upload identifier from /initialize_avatar/start
+    - total_chunks: Number of chunks sent (indices 0 to total_chunks - 1)
+
+    Returns:
+    - JSON response with avatar_id and status, as /initialize_avatar
+    """
+    try:
+        params = await read_params(request)
+        upload_id = params.get('upload_id')
+        upload = avatar_uploads.get(upload_id)
+        if upload is None:
+            return JSONResponse({'error': f'Upload {upload_id} not found'}, status_code=404)
+
+        total_chunks = int(params.get('total_chunks') or len(upload['received']))
+        missing = [index for index in range(total_chunks) if index not in upload['received']]
+        if total_chunks == 0 or missing:
+            return JSONResponse({
+                'error': 'Upload is incomplete',
+                'missing': missing
+            }, status_code=400)
+
+        del avatar_uploads[upload_id]
+        # Chunks beyond total_chunks are not part of the video
+        remove_chunks(upload_id, [index for index in upload['received'] if index >= total_chunks])
+
+        partial_path = os.path.join(api_server.avatar_video_folder, f".upload_{uuid.uuid4().hex}")
+        hasher = content_hash()
+        await asyncio.to_thread(concat_chunks, upload_id, total_chunks, partial_path, hasher)
+
+        video_path = store_upload(partial_path, upload_digest(hasher), upload['filename'])
+        return await create_avatar(upload['avatar_id'], upload['version'], video_path)
+
+    except Exception as e:
+        logger.error(f"Error completing chunked upload: {e}")
+        return JSONResponse({
             'status': 'error',
             'message': f'Avatar initialization failed: {str(e)}'
-        }), 500
+        }, status_code=500)
 
-@app.route('/generate_video', methods=['POST'])
-def generate_video():
+@app.post('/generate_video')
+async def generate_video(request: Request):
     """
     Generate video from audio for a specific avatar.
-    
+
     Expected form data:
     - avatar_id: Avatar identifier
     - audio_file: Audio file (multipart/form-data)
     - output_name: Optional output filename
-    
+    - wait: Optional; "true" blocks until the video is ready and returns it directly
+
+    The audio may also be sent as an application/octet-stream body, with
+    avatar_id, output_name, wait and filename in the query string or X-* headers.
+
     Returns:
-    - Generated video file
+    - 202 with a task_id; poll GET /task/<task_id> and fetch GET /task/<task_id>/result
+    - Generated video file when wait is set
     """
+    request_dir = None
     try:
+        # Stream the upload to disk while parsing the form
+        partial_path, audio_filename, form, digest = await receive_upload(
+            request, 'audio_file', ['avatar_id', 'output_name', 'wait'], 'audio_file.wav'
+        )
+        avatar_id = form['avatar_id']
+
         # Check required parameters
-        avatar_id = request.form.get('avatar_id')
         if not avatar_id:
-            return jsonify({'error': 'avatar_id is required'}), 400
-        
-        if avatar_id not in avatars:
-            return jsonify({'error': f'Avatar {avatar_id} not found. Initialize avatar first.'}), 404
-        
+            discard_upload(partial_path)
+            return JSONResponse({'error': 'avatar_id is required'}, status_code=400)
+
+        wrapper = get_avatar(avatar_id)
+        if wrapper is None:
+            discard_upload(partial_path)
+            return JSONResponse({'error': f'Avatar {avatar_id} not found. Initialize avatar first.'}, status_code=404)
+
         # Check if audio file is provided
-        if 'audio_file' not in request.files:
-            return jsonify({'error': 'No audio file provided'}), 400
-        
-        audio_file = request.files['audio_file']
-        if audio_file.filename == '':
-            return jsonify({'error': 'No audio file selected'}), 400
-        
+        if audio_filename is None:
+            discard_upload(partial_path)
+            return JSONResponse({'error': 'No audio file provided'}, status_code=400)
+
+        if audio_filename == '':
+            discard_upload(partial_path)
+            return JSONResponse({'error': 'No audio file selected'}, status_code=400)
+
         # Get optional parameters
-        output_name = request.form.get('output_name', f'output_{int(time.time())}')
-        
-        # Save uploaded audio
-        audio_filename = secure_filename(audio_file.filename)
-        audio_path = os.path.join(api_server.upload_folder, f"{avatar_id}_{audio_filename}")
-        audio_file.save(audio_path)
-        
+        output_name = form['output_name'] or f'output_{int(time.time())}'
+
+        # Move uploaded audio into this request's scratch dir
+        request_dir = new_scratch_dir("requests")
+        extension = os.path.splitext(secure_filename(audio_filename))[1]
+        audio_path = os.path.join(request_dir, f"{digest}{extension}")
+        os.replace(partial_path, audio_path)
+        cache_path = output_cache_path(avatar_id, digest)
+
         logger.info(f"Generating video for avatar {avatar_id} with audio: {audio_path}")
-        
-        # Generate video
-        wrapper = avatars[avatar_id]
-        video_path = wrapper.generate_video_from_audio(audio_path, output_name)
-        
-        if video_path and os.path.exists(video_path):
-            # Copy video to output folder
-            output_video_path = os.path.join(api_server.output_folder, f"{output_name}.mp4")
-            import shutil
-            shutil.copy2(video_path, output_video_path)
-            
-            logger.info(f"Video generated successfully: {output_video_path}")
-            
-            # Clean up temporary audio file
-            os.unlink(audio_path)
-            
-            # Return the generated video
-            return send_file(
-                output_video_path,
-                as_attachment=True,
-                download_name=f"{output_name}.mp4",
-                mimetype='video/mp4'
+
+        if (form['wait'] or '').lower() not in ('1', 'true', 'yes'):
+            # Run generation in the background and let the client poll for it
+            prune_tasks()
+            task_id = uuid.uuid4().hex
+            record = {
+                'task_id': task_id,
+                'avatar_id': avatar_id,
+                'output_name': output_name,
+                'request_dir': request_dir,
+                'created_at': time.time(),
+                'finished_at': None
+            }
+            record['task'] = asyncio.create_task(
+                run_generation(wrapper, audio_path, output_name, request_dir, cache_path)
             )
+            record['task'].add_done_callback(functools.partial(finish_task, record))
+            TASKS[task_id] = record
+
+            return JSONResponse({
+                'status': 'accepted',
+                'task_id': task_id,
+                'status_url': f'/task/{task_id}',
+                'result_url': f'/task/{task_id}/result'
+            }, status_code=202)
+
+        # Generate video, unless this audio was already rendered for the avatar
+        video_path = cached_video(cache_path, request_dir, output_name)
+        if not video_path:
+            video_path = await wrapper.generate_video_from_audio_async(audio_path, output_name, result_dir=request_dir)
+            if video_path and os.path.exists(video_path):
+                cache_video(video_path, cache_path)
+
+        if video_path and os.path.exists(video_path):
+            logger.info(f"Video generated successfully: {video_path}")
+
+            # Return the generated video straight from the request dir, which
+            # (audio included) is removed once the response has been sent
+            return send_video(video_path, output_name, request_dir)
         else:
-            # Clean up temporary audio file
-            if os.path.exists(audio_path):
-                os.unlink(audio_path)
-            
-            return jsonify({
+            remove_request_dir(request_dir)
+
+            return JSONResponse({
                 'status': 'error',
                 'message': 'Failed to generate video'
-            }), 500
-    
+            }, status_code=500)
+
     except Exception as e:
         logger.error(f"Error generating video: {e}")
-        return jsonify({
+        if request_dir:
+            remove_request_dir(request_dir)
+        return JSONResponse({
             'status': 'error',
             'message': f'Video generation failed: {str(e)}'
-        }), 500
+        }, status_code=500)
+
+@app.get('/task/{task_id}')
+async def get_task(task_id: str):
+    """Get the state of a video generation task"""
+    record = TASKS.get(task_id)
+    if record is None:
+        return JSONResponse({'error': f'Task {task_id} not found'}, status_code=404)
+
+    task = record['task']
+    response = {
+        'task_id': task_id,
+        'avatar_id': record['avatar_id'],
+        'output_name': record['output_name'],
+        'created_at': record['created_at']
+    }
+
+    if not task.done():
+        response['state'] = 'running'
+    elif task.cancelled() or task.exception() is not None:
+        response['state'] = 'failed'
+        response['message'] = 'Task cancelled' if task.cancelled() else str(task.exception())
+    else:
+        response['state'] = 'completed'
+        response['result_url'] = f'/task/{task_id}/result'
 
-@app.route('/generate_video_batch', methods=['POST'])
-def generate_video_batch():
+    return response
+
+@app.get('/task/{task_id}/result')
+async def get_task_result(task_id: str):
+    """Download the video produced by a completed task; the task is removed afterwards"""
+    record = TASKS.get(task_id)
+    if record is None:
+        return JSONResponse({'error': f'Task {task_id} not found'}, status_code=404)
+
+    task = record['task']
+    if not task.done():
+        return JSONResponse({'error': f'Task {task_id} is still running'}, status_code=409)
+
+    del TASKS[task_id]
+    if task.cancelled() or task.exception() is not None:
+        remove_request_dir(record['request_dir'])
+        return JSONResponse({
+            'status': 'error',
+            'message': 'Failed to generate video'
+        }, status_code=500)
+
+    return send_video(task.result(), record['output_name'], record['request_dir'])
+
+@app.post('/generate_video_batch')
+async def generate_video_batch(
+    avatar_id: Optional[str] = Form(None),
+    audio_files: List[UploadFile] = File([])
+):
     """
     Generate multiple videos from multiple audio files for a specific avatar.
-    
+
     Expected form data:
     - avatar_id: Avatar identifier
     - audio_files: Multiple audio files (multipart/form-data)
-    
+
     Returns:
     - ZIP file containing all generated videos
     """
+    request_dir = None
     try:
         # Check required parameters
-        avatar_id = request.form.get('avatar_id')
         if not avatar_id:
-            return jsonify({'error': 'avatar_id is required'}), 400
-        
-        if avatar_id not in avatars:
-            return jsonify({'error': f'Avatar {avatar_id} not found. Initialize avatar first.'}), 404
-        
+            return JSONResponse({'error': 'avatar_id is required'}, status_code=400)
+
+        wrapper = get_avatar(avatar_id)
+        if wrapper is None:
+            return JSONResponse({'error': f'Avatar {avatar_id} not found. Initialize avatar first.'}, status_code=404)
+
         # Check if audio files are provided
-        audio_files = request.files.getlist('audio_files')
         if not audio_files:
-            return jsonify({'error': 'No audio files provided'}), 400
-        
+            return JSONResponse({'error': 'No audio files provided'}, status_code=400)
+
         logger.info(f"Generating {len(audio_files)} videos for avatar {avatar_id}")
-        
-        # Save all audio files
+
+        # Save all audio files into this request's scratch dir
+        request_dir = new_scratch_dir("requests")
         audio_paths = []
         output_names = []
-        
+
+        cache_paths = []
+
         for i, audio_file in enumerate(audio_files):
             if audio_file.filename == '':
                 continue
-            
-            audio_filename = secure_filename(audio_file.filename)
-            audio_path = os.path.join(api_server.upload_folder, f"{avatar_id}_batch_{i}_{audio_filename}")
-            audio_file.save(audio_path)
+
+            extension = os.path.splitext(secure_filename(audio_file.filename))[1]
+            partial_path = os.path.join(request_dir, f"batch_{i}{extension}")
+            hasher = content_hash()
+            await async_save(audio_file, partial_path, hasher)
+            digest = upload_digest(hasher)
+            audio_path = os.path.join(request_dir, f"batch_{i}_{digest}{extension}")
+            os.replace(partial_path, audio_path)
             audio_paths.append(audio_path)
-            
+            cache_paths.append(output_cache_path(avatar_id, digest))
+
             output_name = f"batch_output_{i}_{int(time.time())}"
             output_names.append(output_name)
-        
+
         if not audio_paths:
-            return jsonify({'error': 'No valid audio files provided'}), 400
-        
+            remove_request_dir(request_dir)
+            return JSONResponse({'error': 'No valid audio files provided'}, status_code=400)
+
+        # Only audio not already rendered for this avatar goes through inference
+        video_paths = [
+            cached_video(cache_path, request_dir, output_name)
+            for cache_path, output_name in zip(cache_paths, output_names)
+        ]
+        pending = [i for i, video_path in enumerate(video_paths) if not video_path]
+
         # Generate videos in batch
-        wrapper = avatars[avatar_id]
-        video_paths = wrapper.generate_video_batch(audio_paths, output_names)
-        
-        # Create ZIP file with generated videos
-        import zipfile
-        zip_path = os.path.join(api_server.output_folder, f"batch_{avatar_id}_{int(time.time())}.zip")
-        
-        with zipfile.ZipFile(zip_path, 'w') as zip_file:
-            for i, video_path in enumerate(video_paths):
+        if pending:
+            generated = await wrapper.generate_video_batch_async(
+                [audio_paths[i] for i in pending],
+                [output_names[i] for i in pending],
+                result_dir=request_dir
+            )
+            for i, video_path in zip(pending, generated):
                 if video_path and os.path.exists(video_path):
-                    zip_file.write(video_path, f"{output_names[i]}.mp4")
-        
-        # Clean up temporary audio files
-        for audio_path in audio_paths:
-            if os.path.exists(audio_path):
-                os.unlink(audio_path)
-        
-        logger.info(f"Batch generation completed: {zip_path}")
-        
-        # Return the ZIP file
-        return send_file(
-            zip_path,
-            as_attachment=True,
-            download_name=f"batch_videos_{avatar_id}.zip",
-            mimetype='application/zip'
+                    cache_video(video_path, cache_paths[i])
+                video_paths[i] = video_path
+
+        # Build the ZIP lazily; it is generated while being sent and never written to disk.
+        # MP4s are already compressed, so store them as-is
+        zip_stream = ZipStream(compress_type=ZIP_STORED)
+        for i, video_path in enumerate(video_paths):
+            if video_path and os.path.exists(video_path):
+                zip_stream.add_path(video_path, f"{output_names[i]}.mp4")
+
+        logger.info(f"Batch generation completed: {len(zip_stream)} bytes to stream")
+
+        # Stream the ZIP file
+        return StreamingResponse(
+            zip_stream,
+            media_type='application/zip',
+            headers={
+                'Content-Disposition': f'attachment; filename="batch_videos_{avatar_id}.zip"',
+                'Content-Length': str(len(zip_stream))
+            },
+            # Videos and audio are removed once the ZIP has been streamed
+            background=BackgroundTask(remove_request_dir, request_dir)
         )
-    
+
     except Exception as e:
         logger.error(f"Error in batch generation: {e}")
-        return jsonify({
+        if request_dir:
+            remove_request_dir(request_dir)
+        return JSONResponse({
             'status': 'error',
             'message': f'Batch generation failed: {str(e)}'
-        }), 500
+        }, status_code=500)
 
-@app.route('/list_avatars', methods=['GET'])
-def list_avatars():
+@app.get('/list_avatars')
+@cached(timeout=2)
+async def list_avatars():
     """List all initialized avatars"""
     try:
         avatar_list = []
-        for avatar_id, wrapper in avatars.items():
+        for row in load_avatars():
             avatar_list.append({
-                'avatar_id': avatar_id,
-                'version': wrapper.version,
-                'video_path': wrapper.avatar_video_path
+                'avatar_id': row['avatar_id'],
+                'version': row['version'],
+                'video_path': row['video_path']
             })
-        
-        return jsonify({
+
+        return {
             'status': 'success',
             'avatars': avatar_list,
             'count': len(avatar_list)
-        })
-    
+        }
+
     except Exception as e:
         logger.error(f"Error listing avatars: {e}")
-        return jsonify({
+        return JSONResponse({
             'status': 'error',
             'message': f'Failed to list avatars: {str(e)}'
-        }), 500
+        }, status_code=500)
 
-@app.route('/delete_avatar', methods=['DELETE'])
-def delete_avatar():
+@app.delete('/delete_avatar')
+async def delete_avatar(request: Request):
     """Delete an avatar and clean up resources"""
     try:
-        avatar_id = request.json.get('avatar_id') if request.is_json else request.form.get('avatar_id')
-        
+        avatar_id = (await read_params(request)).get('avatar_id')
+
         if not avatar_id:
-            return jsonify({'error': 'avatar_id is required'}), 400
-        
-        if avatar_id not in avatars:
-            return jsonify({'error': f'Avatar {avatar_id} not found'}), 404
-        
-        # Clean up avatar resources
-        wrapper = avatars[avatar_id]
+            return JSONResponse({'error': 'avatar_id is required'}, status_code=400)
+
+        wrapper = get_avatar(avatar_id)
+        if wrapper is None:
+            return JSONResponse({'error': f'Avatar {avatar_id} not found'}, status_code=404)
+
+        # Clean up avatar resources (temp files, prepared data, source video, cached videos and cached VRAM)
+        remove_avatar(avatar_id)
         wrapper.cleanup()
-        
+        shutil.rmtree(wrapper.prep_dir, ignore_errors=True)
+        release_avatar_video(wrapper.avatar_video_path)
+        clear_output_cache(avatar_id)
+
         # Remove from storage
         del avatars[avatar_id]
         if avatar_id in processing_queues:
             del processing_queues[avatar_id]
-        
+        invalidate_cache('list_avatars', 'get_status')
+
         logger.info(f"Avatar {avatar_id} deleted successfully")
-        
-        return jsonify({
+
+        return {
             'status': 'success',
             'message': f'Avatar {avatar_id} deleted successfully'
-        })
-    
+        }
+
     except Exception as e:
         logger.error(f"Error deleting avatar: {e}")
-        return jsonify({
+        return JSONResponse({
             'status': 'error',
             'message': f'Failed to delete avatar: {str(e)}'
-        }), 500
+        }, status_code=500)
+
+@app.post('/gc')
+async def collect_garbage():
+    """
+    Admin endpoint: run the garbage collector and return cached CUDA memory held by
+    this process to the driver. Pool workers manage their own cache.
+    """
+    try:
+        collected = gc.collect()
+        release_cuda_cache()
 
-@app.route('/status', methods=['GET'])
-def get_status():
+        return {
+            'status': 'success',
+            'collected_objects': collected
+        }
+
+    except Exception as e:
+        logger.error(f"Error during garbage collection: {e}")
+        return JSONResponse({
+            'status': 'error',
+            'message': f'Garbage collection failed: {str(e)}'
+        }, status_code=500)
+
+@app.get('/status')
+@cached(timeout=2)
+async def get_status():
     """Get server status and statistics"""
     try:
-        return jsonify({
+        avatar_ids = [row['avatar_id'] for row in load_avatars()]
+        return {
             'status': 'running',
-            'avatars_count': len(avatars),
-            'avatar_ids': list(avatars.keys()),
+            'avatars_count': len(avatar_ids),
+            'avatar_ids': avatar_ids,
             'upload_folder': api_server.upload_folder,
             'output_folder': api_server.output_folder,
+            'data_folder': api_server.data_folder,
             'timestamp': time.time()
-        })
-    
+        }
+
     except Exception as e:
         logger.error(f"Error getting status: {e}")
-        return jsonify({
+        return JSONResponse({
             'status': 'error',
             'message': f'Failed to get status: {str(e)}'
-        }), 500
+        }, status_code=500)
 
 if __name__ == '__main__':
-    # Run the Flask app
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--port", type=int, default=5000, help="Port to listen on")
+    parser.add_argument("--workers", type=int, default=int(os.environ.get('MUSETALK_API_WORKERS', 1)), help="Number of HTTP worker processes")
+    parser.add_argument("--concurrency", type=int, default=int(os.environ.get('MUSETALK_CONCURRENCY', 1)), help="Number of MuseTalk inference workers per version (0 runs inference in the server process)")
+    args = parser.parse_args()
+
+    # Read by get_worker_pool in every HTTP worker process
+    os.environ['MUSETALK_CONCURRENCY'] = str(args.concurrency)
+
+    # Run the ASGI app. Avatars are shared through avatars.db, but every HTTP worker
+    # starts its own inference workers and tracks its own generation tasks, so keep a
+    # single HTTP worker unless requests are pinned to workers by a sticky proxy.
     logger.info("Starting MuseTalk API Server...")
-    app.run(
+    uvicorn.run(
+        "api_server:app",
         host='0.0.0.0',
-        port=5000,
-        debug=False,
-        threaded=True
-    )
\ No newline at end of file
+        port=args.port,
+        workers=args.workers,
+        loop='auto',  # uvloop when it is installed
+        http='httptools'
+    )
@@ -0,0 +1,41 @@
+"""
+Gunicorn settings for the MuseTalk API server.
+
+    gunicorn -c gunicorn_conf.py api_server:app
+
+Each worker runs the FastAPI app on its own Uvicorn event loop. Prepared avatars are
+recorded in a shared sqlite database, so any worker can serve any avatar, but every
+worker starts its own inference pool (and loads its own copy of the models), and
+background generation tasks are tracked per worker. Only raise MUSETALK_API_WORKERS
+when there is VRAM to spare and clients are pinned to a worker (e.g. by a sticky
+load balancer) or always call /generate_video with wait=true.
+"""
+import os
+
+bind = os.environ.get("MUSETALK_API_BIND", "0.0.0.0:5000")
+workers = int(os.environ.get("MUSETALK_API_WORKERS", 1))
+worker_class = "uvicorn.workers.UvicornWorker"
+
+# Import the app (and the heavy modules below) once in the master, then fork
+preload_app = True
+
+# Avatar preparation and batch generation can run for several minutes
+timeout = 600
+graceful_timeout = 60
+
+def when_ready(server):
+    """
+    Import the heavy third-party modules in the master so forked workers share
+    them copy-on-write instead of importing them again.
+
+    scripts.inference is deliberately not imported here: musetalk.utils.preprocessing
+    loads its face detection models onto the GPU at import time, and a worker forked
+    from a master that has initialized CUDA cannot use CUDA itself (which breaks
+    MUSETALK_CONCURRENCY=0). Importing torch alone does not initialize CUDA.
+    """
+    import cv2  # noqa: F401
+    import torch  # noqa: F401
+    import transformers  # noqa: F401
+    from omegaconf import OmegaConf  # noqa: F401
+
+    server.log.info("MuseTalk inference modules preloaded")
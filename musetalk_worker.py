@@ -0,0 +1,315 @@
+import multiprocessing as mp
+import threading
+import atexit
+import os
+import sys
+import time
+import logging
+from collections import deque
+from concurrent.futures import Future, TimeoutError
+
+logger = logging.getLogger(__name__)
+
+# Model weights used by the original inference scripts, per MuseTalk version
+MODEL_PATHS = {
+    "v15": ("models/musetalkV15/unet.pth", "models/musetalkV15/musetalk.json"),
+    "v1": ("models/musetalk/pytorch_model.bin", "models/musetalk/musetalk.json"),
+}
+
+# Fraction of VRAM reserved by PyTorch above which workers empty the CUDA cache
+VRAM_HIGH_WATERMARK = float(os.environ.get("MUSETALK_VRAM_HIGH_WATERMARK", 0.9))
+
+def inference_argv(version, batch_size=8):
+    """Command line arguments for scripts.inference matching the given version"""
+    unet_model_path, unet_config = MODEL_PATHS[version]
+    return [
+        "--version", version,
+        "--batch_size", str(batch_size),
+        "--unet_model_path", unet_model_path,
+        "--unet_config", unet_config
+    ]
+
+# Seconds between checks for dead workers and overrunning tasks
+WATCHDOG_INTERVAL = 1.0
+
+def _worker_main(project_path, version, task_queue, result_queue):
+    """
+    Worker process entry point.
+    Loads the MuseTalk models once, reports ready, then runs inference tasks until it
+    receives None. Every message it sends carries its pid, so the pool can tell a
+    replaced worker's late messages apart.
+    """
+    pid = os.getpid()
+    try:
+        # Model paths in the original scripts are relative to the project root
+        os.chdir(project_path)
+        sys.path.insert(0, project_path)
+
+        from scripts import inference
+        from musetalk_wrapper import load_unet, release_cuda_cache
+
+        unet_model_path, unet_config = MODEL_PATHS[version]
+        models = load_unet(version, unet_model_path, unet_config)
+    except Exception as e:
+        result_queue.put(("failed", pid, f"{type(e).__name__}: {e}"))
+        return
+    result_queue.put(("ready", pid, None))
+
+    while True:
+        task = task_queue.get()
+        if task is None:
+            break
+
+        try:
+            inference.run_inference(
+                task["inference_config"],
+                version=version,
+                unet_model_path=unet_model_path,
+                unet_config=unet_config,
+                result_dir=task["result_dir"],
+                models=models
+            )
+            result_queue.put(("done", pid, None))
+        except Exception as e:
+            result_queue.put(("done", pid, f"{type(e).__name__}: {e}"))
+
+        # Avoid fragmentation slowdowns once the allocator cache nears the VRAM cap
+        release_cuda_cache(threshold=VRAM_HIGH_WATERMARK)
+
+class _Worker:
+    """A worker process, its private task queue and the task it is running"""
+
+    def __init__(self, process, task_queue):
+        self.process = process
+        self.task_queue = task_queue
+        self.ready = False
+        self.failed = False
+        self.future = None
+        self.deadline = None
+
+class MuseTalkWorkerPool:
+    """
+    Pool of long-lived processes that keep the MuseTalk models resident on the GPU.
+    Tasks are plain inference_config dicts; submit() returns a Future that resolves
+    once a worker has finished writing the results.
+
+    Tasks wait in this process and are handed to a worker only once it is idle, so a
+    task's timeout starts when a worker picks it up, and a task whose future was
+    cancelled while waiting is never run. A watchdog fails the task of a worker that
+    died or overran its timeout and replaces the worker.
+    """
+
+    def __init__(self, musetalk_project_path=".", version="v15", concurrency=1):
+        self.musetalk_project_path = os.path.abspath(musetalk_project_path)
+        self.version = version
+        self.concurrency = concurrency
+
+        # CUDA cannot be re-initialized in forked children, so always spawn
+        self._ctx = mp.get_context("spawn")
+        self.result_queue = self._ctx.Queue()
+        self._pending = deque()
+        self._lock = threading.Lock()
+        self._stopping = False
+        self._load_error = None
+
+        self.workers = [self._spawn() for _ in range(concurrency)]
+
+        self._dispatcher = threading.Thread(target=self._dispatch_results, daemon=True)
+        self._dispatcher.start()
+        self._watchdog = threading.Thread(target=self._watch_workers, daemon=True)
+        self._watchdog.start()
+
+        logger.info(f"Started {concurrency} MuseTalk {version} worker(s)")
+
+    def _spawn(self):
+        task_queue = self._ctx.Queue()
+        process = self._ctx.Process(
+            target=_worker_main,
+            args=(self.musetalk_project_path, self.version, task_queue, self.result_queue),
+            daemon=True
+        )
+        process.start()
+        return _Worker(process, task_queue)
+
+    def _find_worker(self, pid):
+        for worker in self.workers:
+            if worker.process.pid == pid:
+                return worker
+        return None
+
+    def _schedule(self):
+        """Hand waiting tasks to idle workers; call with the lock held"""
+        for worker in self.workers:
+            if not worker.ready or worker.future is not None:
+                continue
+            while self._pending:
+                future, task, timeout = self._pending.popleft()
+                # False if the future was cancelled while it waited
+                if future.set_running_or_notify_cancel():
+                    worker.future = future
+                    worker.deadline = time.monotonic() + timeout if timeout else None
+                    worker.task_queue.put(task)
+                    break
+
+    def _fail_pending(self, error):
+        """Fail every waiting task; call with the lock held, returns (future, error) pairs"""
+        failed = []
+        while self._pending:
+            future, _, _ = self._pending.popleft()
+            if future.set_running_or_notify_cancel():
+                failed.append((future, error))
+        return failed
+
+    def _dispatch_results(self):
+        """Resolve futures as workers report results"""
+        while True:
+            message = self.result_queue.get()
+            if message is None:
+                break
+
+            kind, pid, error = message
+            resolved = []
+            with self._lock:
+                worker = self._find_worker(pid)
+                if worker is None:
+                    # From a worker that has since been replaced
+                    continue
+
+                if kind == "ready":
+                    worker.ready = True
+                elif kind == "failed":
+                    logger.error(f"MuseTalk worker {pid} failed to load models: {error}")
+                    worker.failed = True
+                    self._load_error = error
+                    if all(w.failed for w in self.workers):
+                        resolved = self._fail_pending(RuntimeError(f"No MuseTalk worker could start: {error}"))
+                elif worker.future is not None:
+                    resolved.append((worker.future, RuntimeError(error) if error else None))
+                    worker.future = None
+                    worker.deadline = None
+
+                self._schedule()
+
+            for future, exc in resolved:
+                if exc is None:
+                    future.set_result(None)
+                else:
+                    future.set_exception(exc)
+
+    def _watch_workers(self):
+        """Replace workers that died or overran their task's timeout, failing that task"""
+        while not self._stopping:
+            time.sleep(WATCHDOG_INTERVAL)
+            resolved = []
+            with self._lock:
+                if self._stopping:
+                    break
+                now = time.monotonic()
+                for i, worker in enumerate(self.workers):
+                    if worker.failed:
+                        continue
+
+                    if not worker.ready and not worker.process.is_alive():
+                        # Died while loading the models; restarting would most likely die again
+                        error = f"worker exited with code {worker.process.exitcode} while loading models"
+                        logger.error(f"MuseTalk {error}")
+                        worker.failed = True
+                        self._load_error = error
+                        if all(w.failed for w in self.workers):
+                            resolved.extend(self._fail_pending(RuntimeError(f"No MuseTalk worker could start: {error}")))
+                        continue
+
+                    if not worker.process.is_alive():
+                        exc = RuntimeError(f"MuseTalk worker exited with code {worker.process.exitcode}")
+                    elif worker.deadline is not None and now > worker.deadline:
+                        # The worker cannot be interrupted mid-task; free its GPU time instead
+                        exc = TimeoutError("MuseTalk inference timed out")
+                        worker.process.terminate()
+                    else:
+                        continue
+
+                    logger.error(f"{exc}; restarting worker {worker.process.pid}")
+                    if worker.future is not None:
+                        resolved.append((worker.future, exc))
+                    self.workers[i] = self._spawn()
+
+                self._schedule()
+
+            for future, exc in resolved:
+                future.set_exception(exc)
+
+    def submit(self, inference_config, result_dir, timeout=None):
+        """
+        Queue an inference_config for the workers, returning a Future.
+        timeout (seconds) counts from when a worker starts the task; an overrunning task
+        fails with concurrent.futures.TimeoutError and its worker is restarted.
+        """
+        future = Future()
+        task = {
+            "inference_config": inference_config,
+            "result_dir": result_dir
+        }
+        with self._lock:
+            if self._stopping:
+                raise RuntimeError("MuseTalk worker pool is shut down")
+            if all(worker.failed for worker in self.workers):
+                future.set_exception(RuntimeError(f"No MuseTalk worker could start: {self._load_error}"))
+                return future
+            self._pending.append((future, task, timeout))
+            self._schedule()
+        return future
+
+    def shutdown(self):
+        """Stop all workers after they finish their current task"""
+        with self._lock:
+            self._stopping = True
+            failed = self._fail_pending(RuntimeError("MuseTalk worker pool shut down"))
+            workers = list(self.workers)
+        for future, exc in failed:
+            future.set_exception(exc)
+
+        for worker in workers:
+            worker.task_queue.put(None)
+        for worker in workers:
+            worker.process.join(timeout=30)
+            if worker.process.is_alive():
+                worker.process.terminate()
+
+        # Let the dispatcher resolve what the workers reported, then fail the rest
+        self.result_queue.put(None)
+        self._dispatcher.join(timeout=5)
+        with self._lock:
+            running = [worker.future for worker in workers if worker.future is not None]
+            for worker in workers:
+                worker.future = None
+        for future in running:
+            future.set_exception(RuntimeError("MuseTalk worker pool shut down"))
+
+# Pools are shared by every wrapper in the process, one per project path and version
+_pools = {}
+_pools_lock = threading.Lock()
+
+def get_worker_pool(musetalk_project_path=".", version="v15", concurrency=None):
+    """Return the shared worker pool for a project and version, starting it if needed"""
+    # Pools are never evicted, so an arbitrary version string must not create one
+    if version not in MODEL_PATHS:
+        raise ValueError(f"Unknown MuseTalk version: {version!r}")
+    if concurrency is None:
+        concurrency = int(os.environ.get("MUSETALK_CONCURRENCY", 1))
+
+    key = (os.path.abspath(musetalk_project_path), version)
+    with _pools_lock:
+        pool = _pools.get(key)
+        if pool is None:
+            pool = MuseTalkWorkerPool(musetalk_project_path, version, concurrency)
+            _pools[key] = pool
+        return pool
+
+@atexit.register
+def shutdown_worker_pools():
+    """Stop every shared worker pool"""
+    with _pools_lock:
+        pools = list(_pools.values())
+        _pools.clear()
+    for pool in pools:
+        pool.shutdown()
@@ -1,3 +1,4 @@
+import asyncio
 import subprocess
 import tempfile
 import os
@@ -5,22 +6,104 @@ import time
 import shutil
 import json
 import yaml
+import sys
+import gc
+import uuid
+import re
+import threading
+import concurrent.futures
+from collections import deque
+from functools import lru_cache
 from pathlib import Path
 import logging
+from musetalk_worker import MODEL_PATHS, get_worker_pool, inference_argv
+
+# Shared scratch space for wrappers and requests; point it at tmpfs for RAM-speed I/O
+SCRATCH_DIR = os.environ.get(
+    "MUSETALK_SCRATCH",
+    "/dev/shm/musetalk" if os.path.isdir("/dev/shm") else os.path.join(tempfile.gettempdir(), "musetalk")
+)
+
+def new_scratch_dir(kind):
+    """Create a fresh, uniquely named directory under SCRATCH_DIR/<kind>"""
+    path = os.path.join(SCRATCH_DIR, kind, uuid.uuid4().hex)
+    os.makedirs(path)
+    return path
+
+# libyaml-backed dumper when PyYAML was built with it
+YAML_DUMPER = getattr(yaml, "CSafeDumper", yaml.SafeDumper)
+
+# Only the last lines of a script's stderr are kept, for error messages
+STDERR_TAIL_LINES = 50
+
+# Timeouts raised by the different inference backends
+TIMEOUT_ERRORS = (subprocess.TimeoutExpired, concurrent.futures.TimeoutError, asyncio.TimeoutError)
+
+@lru_cache(maxsize=4)
+def load_unet(version, unet_model_path, unet_config, whisper_dir="./models/whisper"):
+    """
+    Process-global model registry.
+    Returns the UNet, VAE, Whisper and friends for a checkpoint, loaded onto the GPU
+    in eval mode on first use and shared by every wrapper and request afterwards.
+    """
+    from scripts.inference import load_models_for
+    
+    models = load_models_for(version, unet_model_path, unet_config, whisper_dir)
+    models["unet"].model.eval()
+    models["vae"].vae.eval()
+    models["pe"].eval()
+    return models
+
+def release_cuda_cache(threshold=None):
+    """
+    Return cached but unused CUDA memory to the driver; loaded models are kept.
+    With a threshold (fraction of total VRAM), only release once the caching
+    allocator has reserved more than that.
+    """
+    try:
+        import torch
+    except ImportError:
+        return
+    
+    if not torch.cuda.is_available():
+        return
+    
+    if threshold is not None:
+        total = torch.cuda.get_device_properties(torch.cuda.current_device()).total_memory
+        if torch.cuda.memory_reserved() < threshold * total:
+            return
+    
+    torch.cuda.empty_cache()
 
 class MuseTalkWrapper:
     """
-    Wrapper class that interfaces with existing MuseTalk scripts without any modifications.
-    Uses subprocess calls to execute the original inference scripts.
+    Wrapper class that interfaces with existing MuseTalk scripts.
+    
+    Video generation runs on one of three backends:
+    - num_workers > 0: a shared pool of long-lived workers that keep the models loaded
+    - num_workers == 0: scripts.inference.run_inference, in this process
+    - use_subprocess=True: `python -m scripts.inference` per call (compatibility fallback)
+    
+    Avatar preparation always runs the original realtime script; pass prepared_dir
+    to reuse the data an earlier preparation left in prep_dir.
     """
     
-    def __init__(self, avatar_video_path, musetalk_project_path=".", version="v15"):
+    def __init__(self, avatar_video_path, musetalk_project_path=".", version="v15",
+                 num_workers=None, use_subprocess=False, prepared_dir=None):
+        if version not in MODEL_PATHS:
+            raise ValueError(f"Unknown MuseTalk version: {version!r}")
         self.avatar_video_path = os.path.abspath(avatar_video_path)
         self.musetalk_project_path = os.path.abspath(musetalk_project_path)
         self.version = version
-        self.temp_dir = tempfile.mkdtemp(prefix="musetalk_wrapper_")
+        self.temp_dir = new_scratch_dir("wrappers")
         self.avatar_prepared = False
-        self.avatar_id = f"avatar_{int(time.time())}"
+        # Unique per wrapper so two avatars never share a prep_dir
+        self.avatar_id = f"avatar_{uuid.uuid4().hex}"
+        
+        # Adopt an avatar prepared by an earlier wrapper instead of preparing it again
+        if prepared_dir and os.path.isdir(prepared_dir):
+            self.avatar_id = os.path.basename(os.path.normpath(prepared_dir))
+            self.avatar_prepared = True
         
         # Setup logging
         logging.basicConfig(level=logging.INFO)
@@ -33,8 +116,147 @@ class MuseTalkWrapper:
         if not os.path.exists(os.path.join(self.musetalk_project_path, "scripts", "inference.py")):
             raise FileNotFoundError(f"MuseTalk project not found at: {self.musetalk_project_path}")
         
+        if num_workers is None:
+            num_workers = int(os.environ.get("MUSETALK_CONCURRENCY", 1))
+        self.num_workers = num_workers
+        self.use_subprocess = use_subprocess
+        
+        # Attach to (or start) the worker pool for this version
+        self.pool = None
+        if not use_subprocess and num_workers > 0:
+            self.pool = get_worker_pool(self.musetalk_project_path, self.version, num_workers)
+            self.num_workers = self.pool.concurrency
+        
         self.logger.info(f"MuseTalk Wrapper initialized with avatar: {self.avatar_video_path}")
     
+    @property
+    def prep_dir(self):
+        """Directory where the realtime script caches this avatar's prepared data"""
+        if self.version == "v15":
+            return os.path.join(self.musetalk_project_path, "results", self.version, "avatars", self.avatar_id)
+        return os.path.join(self.musetalk_project_path, "results", "avatars", self.avatar_id)
+    
+    def _build_command(self, script, config_path, result_dir, config_flag="--inference_config"):
+        """Build the command line for one of the original MuseTalk scripts"""
+        return [
+            "python", "-m", script,
+            config_flag, config_path,
+            "--result_dir", result_dir
+        ] + inference_argv(self.version)
+    
+    def _log_stderr_line(self, line, tail):
+        """Forward one line of script output to the logger, remembering the tail"""
+        line = line.rstrip()
+        if line:
+            self.logger.debug(line)
+            tail.append(line)
+    
+    def _drain_stderr(self, stream, tail):
+        for line in stream:
+            self._log_stderr_line(line, tail)
+    
+    async def _drain_stderr_async(self, stream, tail):
+        # Read in chunks rather than readline(): tqdm progress bars only emit \r
+        pending = b""
+        while True:
+            chunk = await stream.read(1 << 16)
+            if not chunk:
+                break
+            lines = re.split(rb"[\r\n]", pending + chunk)
+            pending = lines.pop()
+            for line in lines:
+                self._log_stderr_line(line.decode(errors="replace"), tail)
+        self._log_stderr_line(pending.decode(errors="replace"), tail)
+    
+    def _run_command(self, cmd, timeout):
+        """
+        Run a MuseTalk script, blocking until it exits.
+        stderr is streamed to the logger as it is produced instead of being buffered;
+        the returned CompletedProcess only carries its last STDERR_TAIL_LINES lines.
+        """
+        proc = subprocess.Popen(
+            cmd,
+            cwd=self.musetalk_project_path,
+            stdout=subprocess.DEVNULL,
+            stderr=subprocess.PIPE,
+            text=True,
+            errors="replace",
+            bufsize=1
+        )
+        tail = deque(maxlen=STDERR_TAIL_LINES)
+        reader = threading.Thread(target=self._drain_stderr, args=(proc.stderr, tail), daemon=True)
+        reader.start()
+        
+        try:
+            proc.wait(timeout=timeout)
+        except subprocess.TimeoutExpired:
+            proc.kill()
+            proc.wait()
+            raise
+        finally:
+            reader.join()
+            proc.stderr.close()
+        
+        return subprocess.CompletedProcess(cmd, proc.returncode, None, "\n".join(tail))
+    
+    async def _run_command_async(self, cmd, timeout):
+        """
+        Run a MuseTalk script without blocking the event loop.
+        Mirrors _run_command, including raising subprocess.TimeoutExpired.
+        """
+        proc = await asyncio.create_subprocess_exec(
+            *cmd,
+            cwd=self.musetalk_project_path,
+            stdout=asyncio.subprocess.DEVNULL,
+            stderr=asyncio.subprocess.PIPE
+        )
+        tail = deque(maxlen=STDERR_TAIL_LINES)
+        
+        try:
+            await asyncio.wait_for(
+                asyncio.gather(self._drain_stderr_async(proc.stderr, tail), proc.wait()),
+                timeout=timeout
+            )
+        except asyncio.TimeoutError:
+            proc.kill()
+            await proc.wait()
+            raise subprocess.TimeoutExpired(cmd, timeout)
+        
+        return subprocess.CompletedProcess(cmd, proc.returncode, None, "\n".join(tail))
+    
+    def _prepare_avatar_command(self):
+        """Write the realtime preparation config and return the command to run"""
+        # Create dummy audio file for preparation
+        dummy_audio_path = os.path.join(self.temp_dir, "dummy.wav")
+        self._create_dummy_audio(dummy_audio_path)
+        
+        # Create configuration file for realtime preparation
+        config_content = {
+            self.avatar_id: {
+                "preparation": True,
+                "video_path": self.avatar_video_path,
+                "bbox_shift": 0 if self.version == "v15" else 0,
+                "audio_clips": {
+                    "dummy": dummy_audio_path
+                }
+            }
+        }
+        
+        config_path = os.path.join(self.temp_dir, "realtime_config.yaml")
+        with open(config_path, 'w') as f:
+            yaml.dump(config_content, f, Dumper=YAML_DUMPER)
+        
+        return self._build_command("scripts.realtime_inference", config_path, self.temp_dir)
+    
+    def _finish_avatar_preparation(self, result):
+        if result.returncode == 0:
+            self.avatar_prepared = True
+            self.logger.info("Avatar preparation completed successfully")
+            return True
+        else:
+            self.logger.error(f"Avatar preparation failed: {result.stderr}")
+            return False
+    
     def prepare_avatar_realtime(self):
         """
         Prepare avatar for real-time inference using the existing realtime_inference.py script.
@@ -44,64 +266,12 @@ class MuseTalkWrapper:
             return True
         
         try:
-            # Create dummy audio file for preparation
-            dummy_audio_path = os.path.join(self.temp_dir, "dummy.wav")
-            self._create_dummy_audio(dummy_audio_path)
-            
-            # Create configuration file for realtime preparation
-            config_content = {
-                self.avatar_id: {
-                    "preparation": True,
-                    "video_path": self.avatar_video_path,
-                    "bbox_shift": 0 if self.version == "v15" else 0,
-                    "audio_clips": {
-                        "dummy": dummy_audio_path
-                    }
-                }
-            }
-            
-            config_path = os.path.join(self.temp_dir, "realtime_config.yaml")
-            with open(config_path, 'w') as f:
-                yaml.dump(config_content, f)
-            
-            # Prepare command for realtime inference
-            cmd = [
-                "python", "-m", "scripts.realtime_inference",
-                "--inference_config", config_path,
-                "--version", self.version,
-                "--result_dir", self.temp_dir,
-                "--batch_size", "8"
-            ]
-            
-            if self.version == "v15":
-                cmd.extend([
-                    "--unet_model_path", "models/musetalkV15/unet.pth",
-                    "--unet_config", "models/musetalkV15/musetalk.json"
-                ])
-            else:
-                cmd.extend([
-                    "--unet_model_path", "models/musetalk/pytorch_model.bin",
-                    "--unet_config", "models/musetalk/musetalk.json"
-                ])
-            
+            cmd = self._prepare_avatar_command()
             self.logger.info("Preparing avatar for real-time inference...")
             
             # Execute preparation
-            result = subprocess.run(
-                cmd,
-                cwd=self.musetalk_project_path,
-                capture_output=True,
-                text=True,
-                timeout=300  # 5 minute timeout
-            )
-            
-            if result.returncode == 0:
-                self.avatar_prepared = True
-                self.logger.info("Avatar preparation completed successfully")
-                return True
-            else:
-                self.logger.error(f"Avatar preparation failed: {result.stderr}")
-                return False
+            result = self._run_command(cmd, timeout=300)  # 5 minute timeout
+            return self._finish_avatar_preparation(result)
                 
         except subprocess.TimeoutExpired:
             self.logger.error("Avatar preparation timed out")
@@ -110,13 +280,119 @@ class MuseTalkWrapper:
             self.logger.error(f"Error during avatar preparation: {e}")
             return False
     
-    def generate_video_from_audio(self, audio_path, output_name=None):
+    async def prepare_avatar_realtime_async(self):
+        """Awaitable variant of prepare_avatar_realtime for asyncio servers"""
+        if self.avatar_prepared:
+            return True
+        
+        try:
+            cmd = self._prepare_avatar_command()
+            self.logger.info("Preparing avatar for real-time inference...")
+            
+            result = await self._run_command_async(cmd, timeout=300)  # 5 minute timeout
+            return self._finish_avatar_preparation(result)
+        
+        except subprocess.TimeoutExpired:
+            self.logger.error("Avatar preparation timed out")
+            return False
+        except Exception as e:
+            self.logger.error(f"Error during avatar preparation: {e}")
+            return False
+    
+    def _run_in_process(self, inference_config, result_dir):
+        """Run inference in this process with models from the shared registry"""
+        if self.musetalk_project_path not in sys.path:
+            sys.path.insert(0, self.musetalk_project_path)
+        from scripts.inference import run_inference
+        
+        unet_model_path, unet_config = MODEL_PATHS[self.version]
+        unet_model_path = os.path.join(self.musetalk_project_path, unet_model_path)
+        unet_config = os.path.join(self.musetalk_project_path, unet_config)
+        whisper_dir = os.path.join(self.musetalk_project_path, "models", "whisper")
+        
+        run_inference(
+            inference_config,
+            version=self.version,
+            unet_model_path=unet_model_path,
+            unet_config=unet_config,
+            result_dir=result_dir,
+            whisper_dir=whisper_dir,
+            models=load_unet(self.version, unet_model_path, unet_config, whisper_dir)
+        )
+    
+    def _write_task_config(self, inference_config):
+        config_path = os.path.join(self.temp_dir, f"inference_config_{uuid.uuid4().hex}.json")
+        with open(config_path, 'w') as f:
+            json.dump(inference_config, f)
+        return config_path
+    
+    def _run_task(self, inference_config, result_dir, timeout):
+        """Run an inference_config to completion on the configured backend"""
+        if self.use_subprocess:
+            config_path = self._write_task_config(inference_config)
+            cmd = self._build_command("scripts.inference", config_path, result_dir, "--inference_config_json")
+            result = self._run_command(cmd, timeout)
+            if result.returncode != 0:
+                raise RuntimeError(result.stderr)
+        elif self.pool is None:
+            self._run_in_process(inference_config, result_dir)
+        else:
+            # The pool starts the timeout when a worker picks the task up
+            self.pool.submit(inference_config, result_dir, timeout).result()
+    
+    async def _run_task_async(self, inference_config, result_dir, timeout):
+        """Awaitable variant of _run_task"""
+        if self.use_subprocess:
+            config_path = self._write_task_config(inference_config)
+            cmd = self._build_command("scripts.inference", config_path, result_dir, "--inference_config_json")
+            result = await self._run_command_async(cmd, timeout)
+            if result.returncode != 0:
+                raise RuntimeError(result.stderr)
+        elif self.pool is None:
+            await asyncio.to_thread(self._run_in_process, inference_config, result_dir)
+        else:
+            # Cancelling the awaiting task drops the task if no worker has picked it up yet
+            await asyncio.wrap_future(self.pool.submit(inference_config, result_dir, timeout))
+    
+    def _video_task(self, audio_path, output_name, result_dir=None):
+        """Build the inference config for a single audio file and return (config, result_dir)"""
+        task_config = {
+            "task_0": {
+                "video_path": self.avatar_video_path,
+                "audio_path": os.path.abspath(audio_path),
+                "result_name": f"{output_name}.mp4"
+            }
+        }
+        
+        if self.version == "v1":
+            task_config["task_0"]["bbox_shift"] = 0
+        
+        # The coords file lands one level above the results (see _fan_out_dirs), so nest
+        # them inside the caller's dir: jobs on the same avatar then only share that file
+        # if they share the dir
+        result_dir = os.path.join(result_dir or self.temp_dir, "results")
+        os.makedirs(result_dir, exist_ok=True)
+        
+        return task_config, result_dir
+    
+    def _collect_video(self, result_dir, output_name):
+        # Find generated video
+        video_path = os.path.join(result_dir, self.version, f"{output_name}.mp4")
+        if os.path.exists(video_path):
+            self.logger.info(f"Video generated successfully: {video_path}")
+            return video_path
+        else:
+            self.logger.error(f"Generated video not found at expected path: {video_path}")
+            return None
+    
+    def generate_video_from_audio(self, audio_path, output_name=None, result_dir=None):
         """
-        Generate video from audio using the existing inference.py script.
+        Generate video from audio using the configured inference backend.
         
         Args:
             audio_path (str): Path to the audio file
             output_name (str): Optional output name, auto-generated if None
+            result_dir (str): Optional directory to work and write the video in, defaults to the wrapper's temp dir
             
         Returns:
             str: Path to generated video file, None if failed
@@ -129,90 +405,45 @@ class MuseTalkWrapper:
             output_name = f"output_{int(time.time() * 1000)}"
         
         try:
-            # Create configuration file for this inference
-            task_config = {
-                "task_0": {
-                    "video_path": self.avatar_video_path,
-                    "audio_path": os.path.abspath(audio_path),
-                    "result_name": f"{output_name}.mp4"
-                }
-            }
-            
-            if self.version == "v1":
-                task_config["task_0"]["bbox_shift"] = 0
-            
-            config_path = os.path.join(self.temp_dir, f"inference_config_{output_name}.yaml")
-            with open(config_path, 'w') as f:
-                yaml.dump(task_config, f)
-            
-            # Prepare command
-            result_dir = os.path.join(self.temp_dir, "results")
-            os.makedirs(result_dir, exist_ok=True)
-            
-            cmd = [
-                "python", "-m", "scripts.inference",
-                "--inference_config", config_path,
-                "--version", self.version,
-                "--result_dir", result_dir,
-                "--batch_size", "8"
-            ]
-            
-            if self.version == "v15":
-                cmd.extend([
-                    "--unet_model_path", "models/musetalkV15/unet.pth",
-                    "--unet_config", "models/musetalkV15/musetalk.json"
-                ])
-            else:
-                cmd.extend([
-                    "--unet_model_path", "models/musetalk/pytorch_model.bin",
-                    "--unet_config", "models/musetalk/musetalk.json"
-                ])
-            
+            task_config, result_dir = self._video_task(audio_path, output_name, result_dir)
             self.logger.info(f"Generating video for audio: {audio_path}")
             
             # Execute inference
-            result = subprocess.run(
-                cmd,
-                cwd=self.musetalk_project_path,
-                capture_output=True,
-                text=True,
-                timeout=120  # 2 minute timeout per inference
-            )
-            
-            if result.returncode == 0:
-                # Find generated video
-                video_path = os.path.join(result_dir, self.version, f"{output_name}.mp4")
-                if os.path.exists(video_path):
-                    self.logger.info(f"Video generated successfully: {video_path}")
-                    return video_path
-                else:
-                    self.logger.error(f"Generated video not found at expected path: {video_path}")
-                    return None
-            else:
-                self.logger.error(f"Video generation failed: {result.stderr}")
-                return None
+            self._run_task(task_config, result_dir, timeout=120)  # 2 minute timeout per inference
+            return self._collect_video(result_dir, output_name)
                 
-        except subprocess.TimeoutExpired:
+        except TIMEOUT_ERRORS:
             self.logger.error("Video generation timed out")
             return None
         except Exception as e:
             self.logger.error(f"Error during video generation: {e}")
             return None
     
-    def generate_video_batch(self, audio_paths, output_names=None):
-        """
-        Generate multiple videos from multiple audio files in batch.
+    async def generate_video_from_audio_async(self, audio_path, output_name=None, result_dir=None):
+        """Awaitable variant of generate_video_from_audio for asyncio servers"""
+        if not os.path.exists(audio_path):
+            self.logger.error(f"Audio file not found: {audio_path}")
+            return None
         
-        Args:
-            audio_paths (list): List of audio file paths
-            output_names (list): Optional list of output names
+        if output_name is None:
+            output_name = f"output_{int(time.time() * 1000)}"
+        
+        try:
+            task_config, result_dir = self._video_task(audio_path, output_name, result_dir)
+            self.logger.info(f"Generating video for audio: {audio_path}")
             
-        Returns:
-            list: List of generated video paths
-        """
-        if output_names is None:
-            output_names = [f"batch_output_{i}_{int(time.time())}" for i in range(len(audio_paths))]
+            await self._run_task_async(task_config, result_dir, timeout=120)  # 2 minute timeout per inference
+            return self._collect_video(result_dir, output_name)
         
+        except TIMEOUT_ERRORS:
+            self.logger.error("Video generation timed out")
+            return None
+        except Exception as e:
+            self.logger.error(f"Error during video generation: {e}")
+            return None
+    
+    def _batch_task(self, audio_paths, output_names, result_dir=None):
+        """Build the inference config for a batch of audio files and return (config, result_dir)"""
         if len(audio_paths) != len(output_names):
             raise ValueError("Number of audio paths must match number of output names")
         
@@ -229,61 +460,122 @@ class MuseTalkWrapper:
             if self.version == "v1":
                 batch_config[task_key]["bbox_shift"] = 0
         
-        config_path = os.path.join(self.temp_dir, f"batch_config_{int(time.time())}.yaml")
-        with open(config_path, 'w') as f:
-            yaml.dump(batch_config, f)
-        
-        # Execute batch inference
-        result_dir = os.path.join(self.temp_dir, "batch_results")
+        # Nested for the same reason as in _video_task
+        result_dir = os.path.join(result_dir or os.path.join(self.temp_dir, "batch_results"), "results")
         os.makedirs(result_dir, exist_ok=True)
         
-        cmd = [
-            "python", "-m", "scripts.inference",
-            "--inference_config", config_path,
-            "--version", self.version,
-            "--result_dir", result_dir,
-            "--batch_size", "8"
-        ]
+        return batch_config, result_dir
+    
+    def _fan_out_dirs(self, result_dir, count):
+        """
+        Separate result dirs for batch tasks that run concurrently. scripts.inference
+        names its frame directory (<result_dir>/<version>/<video name>) and coords file
+        (<result_dir>/../<video name>.pkl) after the avatar video alone, and removes
+        both when a task finishes, so tasks sharing a result dir would clobber each other.
+        """
+        result_dir = result_dir or os.path.join(self.temp_dir, "batch_results")
+        # The coords file lands one level up, so each task needs its own parent too
+        return [os.path.join(result_dir, f"task_{i}", "results") for i in range(count)]
+    
+    def _collect_batch(self, result_dir, output_names):
+        # Collect generated videos
+        generated_videos = []
+        for output_name in output_names:
+            video_path = os.path.join(result_dir, self.version, f"{output_name}.mp4")
+            if os.path.exists(video_path):
+                generated_videos.append(video_path)
+            else:
+                generated_videos.append(None)
         
-        if self.version == "v15":
-            cmd.extend([
-                "--unet_model_path", "models/musetalkV15/unet.pth",
-                "--unet_config", "models/musetalkV15/musetalk.json"
-            ])
-        else:
-            cmd.extend([
-                "--unet_model_path", "models/musetalk/pytorch_model.bin",
-                "--unet_config", "models/musetalk/musetalk.json"
-            ])
+        self.logger.info(f"Batch generation completed. {len([v for v in generated_videos if v])} videos generated successfully")
+        return generated_videos
+    
+    def generate_video_batch(self, audio_paths, output_names=None, result_dir=None):
+        """
+        Generate multiple videos from multiple audio files in batch.
+        With more than one worker the tasks are fanned out so they run concurrently.
+        
+        Args:
+            audio_paths (list): List of audio file paths
+            output_names (list): Optional list of output names
+            result_dir (str): Optional directory to work and write the video in, defaults to the wrapper's temp dir
+            
+        Returns:
+            list: List of generated video paths
+        """
+        if output_names is None:
+            output_names = [f"batch_output_{i}_{int(time.time())}" for i in range(len(audio_paths))]
+        
+        if self.pool is not None and self.num_workers > 1:
+            if len(audio_paths) != len(output_names):
+                raise ValueError("Number of audio paths must match number of output names")
+            
+            self.logger.info(f"Generating {len(audio_paths)} videos on {self.num_workers} workers")
+            
+            # At most num_workers tasks are in flight, so each task's timeout
+            # only covers its own inference rather than time spent queued
+            task_dirs = self._fan_out_dirs(result_dir, len(audio_paths))
+            with concurrent.futures.ThreadPoolExecutor(max_workers=self.num_workers) as executor:
+                futures = [
+                    executor.submit(self.generate_video_from_audio, audio_path, output_name, task_dir)
+                    for audio_path, output_name, task_dir in zip(audio_paths, output_names, task_dirs)
+                ]
+                generated_videos = [future.result() for future in futures]
+            
+            self.logger.info(f"Batch generation completed. {len([v for v in generated_videos if v])} videos generated successfully")
+            return generated_videos
+        
+        batch_config, result_dir = self._batch_task(audio_paths, output_names, result_dir)
         
         try:
             self.logger.info(f"Generating {len(audio_paths)} videos in batch")
             
-            result = subprocess.run(
-                cmd,
-                cwd=self.musetalk_project_path,
-                capture_output=True,
-                text=True,
-                timeout=300  # 5 minute timeout for batch
-            )
-            
-            if result.returncode == 0:
-                # Collect generated videos
-                generated_videos = []
-                for output_name in output_names:
-                    video_path = os.path.join(result_dir, self.version, f"{output_name}.mp4")
-                    if os.path.exists(video_path):
-                        generated_videos.append(video_path)
-                    else:
-                        generated_videos.append(None)
-                
-                self.logger.info(f"Batch generation completed. {len([v for v in generated_videos if v])} videos generated successfully")
-                return generated_videos
-            else:
-                self.logger.error(f"Batch generation failed: {result.stderr}")
-                return [None] * len(audio_paths)
+            self._run_task(batch_config, result_dir, timeout=300)  # 5 minute timeout for batch
+            return self._collect_batch(result_dir, output_names)
                 
-        except subprocess.TimeoutExpired:
+        except TIMEOUT_ERRORS:
+            self.logger.error("Batch generation timed out")
+            return [None] * len(audio_paths)
+        except Exception as e:
+            self.logger.error(f"Error during batch generation: {e}")
+            return [None] * len(audio_paths)
+    
+    async def generate_video_batch_async(self, audio_paths, output_names=None, result_dir=None):
+        """Awaitable variant of generate_video_batch for asyncio servers"""
+        if output_names is None:
+            output_names = [f"batch_output_{i}_{int(time.time())}" for i in range(len(audio_paths))]
+        
+        if self.pool is not None and self.num_workers > 1:
+            if len(audio_paths) != len(output_names):
+                raise ValueError("Number of audio paths must match number of output names")
+            
+            self.logger.info(f"Generating {len(audio_paths)} videos on {self.num_workers} workers")
+            
+            # Same admission control as the threaded path: one task per worker
+            slots = asyncio.Semaphore(self.num_workers)
+            task_dirs = self._fan_out_dirs(result_dir, len(audio_paths))
+            
+            async def generate(audio_path, output_name, task_dir):
+                async with slots:
+                    return await self.generate_video_from_audio_async(audio_path, output_name, task_dir)
+            
+            generated_videos = await asyncio.gather(*(
+                generate(audio_path, output_name, task_dir)
+                for audio_path, output_name, task_dir in zip(audio_paths, output_names, task_dirs)
+            ))
+            
+            self.logger.info(f"Batch generation completed. {len([v for v in generated_videos if v])} videos generated successfully")
+            return list(generated_videos)
+        
+        batch_config, result_dir = self._batch_task(audio_paths, output_names, result_dir)
+        
+        try:
+            self.logger.info(f"Generating {len(audio_paths)} videos in batch")
+            
+            await self._run_task_async(batch_config, result_dir, timeout=300)  # 5 minute timeout for batch
+            return self._collect_batch(result_dir, output_names)
+        
+        except TIMEOUT_ERRORS:
             self.logger.error("Batch generation timed out")
             return [None] * len(audio_paths)
         except Exception as e:
@@ -308,8 +600,7 @@ class MuseTalkWrapper:
             self.logger.error(f"Error creating dummy audio: {e}")
             return False
     
-    def cleanup(self):
-        """Clean up temporary files"""
+    def _remove_temp_files(self):
         try:
             if os.path.exists(self.temp_dir):
                 shutil.rmtree(self.temp_dir)
@@ -317,9 +608,15 @@ class MuseTalkWrapper:
         except Exception as e:
             self.logger.error(f"Error during cleanup: {e}")
     
+    def cleanup(self):
+        """Clean up temporary files and release GPU memory left over from this avatar"""
+        self._remove_temp_files()
+        gc.collect()
+        release_cuda_cache()
+    
     def __del__(self):
-        """Destructor to ensure cleanup"""
-        self.cleanup()
+        """Destructor to ensure temporary files are removed"""
+        self._remove_temp_files()
 
 # Example usage and testing
 if __name__ == "__main__":
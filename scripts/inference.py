@@ -5,6 +5,7 @@ import copy
 import torch
 import glob
 import shutil
+import json
 import pickle
 import argparse
 import numpy as np
@@ -27,17 +28,19 @@ def fast_check_ffmpeg():
     except:
         return False
 
-@torch.no_grad()
-def main(args):
+def configure_ffmpeg(ffmpeg_path):
     # Configure ffmpeg path
     if not fast_check_ffmpeg():
         print("Adding ffmpeg to PATH")
         # Choose path separator based on operating system
         path_separator = ';' if sys.platform == 'win32' else ':'
-        os.environ["PATH"] = f"{args.ffmpeg_path}{path_separator}{os.environ['PATH']}"
+        os.environ["PATH"] = f"{ffmpeg_path}{path_separator}{os.environ['PATH']}"
         if not fast_check_ffmpeg():
             print("Warning: Unable to find ffmpeg, please ensure ffmpeg is properly installed")
-    
+
+@torch.no_grad()
+def load_models(args):
+    """Load every model needed for inference onto the configured device"""
     # Set computing device
     device = torch.device(f"cuda:{args.gpu_id}" if torch.cuda.is_available() else "cpu")
     # Load model weights
@@ -76,10 +79,78 @@ def main(args):
     else:  # v1
         fp = FaceParsing()
     
+    return {
+        "device": device,
+        "vae": vae,
+        "unet": unet,
+        "pe": pe,
+        "timesteps": timesteps,
+        "audio_processor": audio_processor,
+        "weight_dtype": weight_dtype,
+        "whisper": whisper,
+        "fp": fp,
+    }
+
+@torch.no_grad()
+def main(args):
+    configure_ffmpeg(args.ffmpeg_path)
+    models = load_models(args)
+    
     # Load inference configuration
-    inference_config = OmegaConf.load(args.inference_config)
+    if args.inference_config_json:
+        with open(args.inference_config_json) as f:
+            inference_config = json.load(f)
+    else:
+        inference_config = OmegaConf.load(args.inference_config)
     print("Loaded inference config:", inference_config)
     
+    process_tasks(args, models, inference_config)
+
+def load_models_for(version, unet_model_path, unet_config, whisper_dir="./models/whisper"):
+    """Load models for a version/checkpoint without going through the command line"""
+    args = build_parser().parse_args([])
+    args.version = version
+    args.unet_model_path = unet_model_path
+    args.unet_config = unet_config
+    args.whisper_dir = whisper_dir
+    configure_ffmpeg(args.ffmpeg_path)
+    return load_models(args)
+
+def run_inference(inference_config, version="v15", unet_model_path="./models/musetalkV15/unet.pth",
+                  unet_config="./models/musetalkV15/musetalk.json", result_dir="./results", batch_size=8,
+                  whisper_dir="./models/whisper", models=None):
+    """
+    In-process entry point: run the tasks in inference_config (a dict of task dicts,
+    as found in the YAML configs) without spawning a new interpreter.
+    Pass already loaded models to skip loading them for this call.
+    """
+    args = build_parser().parse_args([])
+    args.version = version
+    args.unet_model_path = unet_model_path
+    args.unet_config = unet_config
+    args.whisper_dir = whisper_dir
+    args.result_dir = result_dir
+    args.batch_size = batch_size
+    if models is None:
+        models = load_models_for(version, unet_model_path, unet_config, whisper_dir)
+    process_tasks(args, models, inference_config)
+
+@torch.no_grad()
+def process_tasks(args, models, inference_config):
+    """
+    Run every task in inference_config with already loaded models.
+    inference_config may be an OmegaConf object or a plain dict of task dicts.
+    """
+    device = models["device"]
+    vae = models["vae"]
+    unet = models["unet"]
+    pe = models["pe"]
+    timesteps = models["timesteps"]
+    audio_processor = models["audio_processor"]
+    weight_dtype = models["weight_dtype"]
+    whisper = models["whisper"]
+    fp = models["fp"]
+    
     # Process each task
     for task_id in inference_config:
         try:
@@ -248,7 +319,7 @@ def main(args):
         except Exception as e:
             print("Error occurred during processing:", e)
 
-if __name__ == "__main__":
+def build_parser():
     parser = argparse.ArgumentParser()
     parser.add_argument("--ffmpeg_path", type=str, default="./ffmpeg-4.4-amd64-static/", help="Path to ffmpeg executable")
     parser.add_argument("--gpu_id", type=int, default=0, help="GPU ID to use")
@@ -257,6 +328,7 @@ if __name__ == "__main__":
     parser.add_argument("--unet_model_path", type=str, default="./models/musetalkV15/unet.pth", help="Path to UNet model weights")
     parser.add_argument("--whisper_dir", type=str, default="./models/whisper", help="Directory containing Whisper model")
     parser.add_argument("--inference_config", type=str, default="configs/inference/test_img.yaml", help="Path to inference configuration file")
+    parser.add_argument("--inference_config_json", type=str, default=None, help="Path to inference configuration as JSON (takes precedence over --inference_config)")
     parser.add_argument("--bbox_shift", type=int, default=0, help="Bounding box shift value")
     parser.add_argument("--result_dir", default='./results', help="Directory for output results")
     parser.add_argument("--extra_margin", type=int, default=10, help="Extra margin for face cropping")
@@ -272,5 +344,8 @@ if __name__ == "__main__":
     parser.add_argument("--left_cheek_width", type=int, default=90, help="Width of left cheek region")
     parser.add_argument("--right_cheek_width", type=int, default=90, help="Width of right cheek region")
     parser.add_argument("--version", type=str, default="v15", choices=["v1", "v15"], help="Model version to use")
-    args = parser.parse_args()
+    return parser
+
+if __name__ == "__main__":
+    args = build_parser().parse_args()
     main(args)
@@ -1,16 +1,25 @@
 import asyncio
 import websockets
-import json
-import base64
+try:
+    import pybase64 as base64  # SIMD-accelerated, same API
+except ImportError:
+    import base64
 import pyaudio
-import wave
 import tempfile
 import os
 import time
-import threading
-import queue
 from pathlib import Path
 import logging
+try:
+    import uvloop
+except ImportError:
+    uvloop = None
+from streaming_protocol import (
+    VIDEO_CHUNK, decode_message, encode_message, pack_audio_chunk, pack_avatar_video, unpack_video_chunk
+)
+
+# Audio chunks waiting to be sent; beyond this the oldest are dropped to keep latency bounded
+MAX_QUEUED_CHUNKS = 3
 
 class MuseTalkStreamingClient:
     """
@@ -30,12 +39,13 @@ class MuseTalkStreamingClient:
         self.audio_format = pyaudio.paInt16
         self.channels = 1
         self.sample_rate = 16000
-        self.chunk_size = 1024
         self.chunk_duration = 2.0  # seconds
         
-        # Queues
-        self.audio_queue = queue.Queue()
-        self.video_queue = queue.Queue()
+        # Queues; audio chunks are handed from the PyAudio callback thread to the event loop
+        self.loop = None
+        self.audio_queue = asyncio.Queue(maxsize=MAX_QUEUED_CHUNKS)
+        self.dropped_chunks = 0
+        self.video_queue = asyncio.Queue()
         
         # Setup logging
         logging.basicConfig(level=logging.INFO)
@@ -52,9 +62,14 @@ class MuseTalkStreamingClient:
                 self.server_url,
                 max_size=50 * 1024 * 1024,  # 50MB max message size
                 ping_interval=20,
-                ping_timeout=10
+                ping_timeout=10,
+                # Raw PCM barely deflates and MP4 is already compressed; deflate only burns CPU
+                compression=None,
+                write_limit=2 ** 22  # Buffer whole multi-MB frames before pausing the sender
             )
             self.is_connected = True
+            # Drop chunks and the end marker left over from an earlier connection
+            self.audio_queue = asyncio.Queue(maxsize=MAX_QUEUED_CHUNKS)
             self.logger.info(f"Connected to server: {self.server_url}")
             
             # Start message handler
@@ -68,6 +83,7 @@ class MuseTalkStreamingClient:
         """Disconnect from the server"""
         try:
             self.is_connected = False
+            self._end_audio_queue()
             if self.websocket:
                 await self.websocket.close()
             self.logger.info("Disconnected from server")
@@ -78,7 +94,18 @@ class MuseTalkStreamingClient:
         """Handle incoming messages from server"""
         try:
             async for message in self.websocket:
-                data = json.loads(message)
+                # Generated videos arrive as tagged binary frames
+                if isinstance(message, bytes):
+                    if message[0] == VIDEO_CHUNK:
+                        # Slice through a memoryview so the multi-MB video is not copied
+                        video_data, timestamp = unpack_video_chunk(memoryview(message))
+                        self.video_queue.put_nowait((video_data, timestamp))
+                        self.logger.info(f"Received video chunk at {timestamp}")
+                    else:
+                        self.logger.warning(f"Unknown binary frame type: {message[0]}")
+                    continue
+                
+                data = decode_message(message)
                 message_type = data.get('type')
                 
                 if message_type == 'connection_established':
@@ -95,12 +122,6 @@ class MuseTalkStreamingClient:
                 elif message_type == 'audio_received':
                     self.logger.debug("Audio chunk received by server")
                 
-                elif message_type == 'video_chunk':
-                    video_data = data.get('video_data')
-                    timestamp = data.get('timestamp')
-                    self.video_queue.put((video_data, timestamp))
-                    self.logger.info(f"Received video chunk at {timestamp}")
-                
                 elif message_type == 'status':
                     self.logger.info(f"Status: {data}")
                 
@@ -112,37 +133,40 @@ class MuseTalkStreamingClient:
                     
         except websockets.exceptions.ConnectionClosed:
             self.logger.info("Connection closed by server")
-            self.is_connected = False
         except Exception as e:
             self.logger.error(f"Error handling messages: {e}")
+        finally:
+            # Also reached when the server closes the connection cleanly
             self.is_connected = False
+            self._end_audio_queue()
     
     async def initialize_avatar(self, avatar_video_path=None, avatar_video_data=None, version="v15"):
-        """Initialize avatar on the server"""
+        """
+        Initialize avatar on the server.
+        avatar_video_data may be raw bytes or, as before, a base64 string.
+        """
         if not self.is_connected:
             raise Exception("Not connected to server")
         
-        message = {
-            'type': 'initialize_avatar',
-            'version': version
-        }
-        
         if avatar_video_path:
             if not os.path.exists(avatar_video_path):
                 raise FileNotFoundError(f"Avatar video not found: {avatar_video_path}")
             
-            # Read and encode video file
+            # Read video file
             with open(avatar_video_path, 'rb') as f:
-                video_data = f.read()
-            message['avatar_video_data'] = base64.b64encode(video_data).decode('utf-8')
-        
-        elif avatar_video_data:
-            message['avatar_video_data'] = avatar_video_data
+                avatar_video_data = f.read()
         
-        else:
+        if not avatar_video_data:
             raise ValueError("Either avatar_video_path or avatar_video_data must be provided")
         
-        await self.websocket.send(json.dumps(message))
+        if isinstance(avatar_video_data, str):
+            await self.websocket.send(encode_message({
+                'type': 'initialize_avatar',
+                'version': version,
+                'avatar_video_data': avatar_video_data
+            }))
+        else:
+            await self.websocket.send(pack_avatar_video(avatar_video_data, version))
         self.logger.info("Avatar initialization request sent")
     
     def start_audio_recording(self):
@@ -152,20 +176,22 @@ class MuseTalkStreamingClient:
             return
         
         try:
+            # Must be called from the event loop the audio is consumed on
+            self.loop = asyncio.get_running_loop()
+            
+            # PortAudio hands over one whole chunk_duration chunk per callback
+            self.is_recording = True
             self.stream = self.audio.open(
                 format=self.audio_format,
                 channels=self.channels,
                 rate=self.sample_rate,
                 input=True,
-                frames_per_buffer=self.chunk_size
+                frames_per_buffer=int(self.sample_rate * self.chunk_duration),
+                stream_callback=self._audio_callback
             )
             
-            self.is_recording = True
             self.logger.info("Started audio recording")
             
-            # Start recording thread
-            threading.Thread(target=self._record_audio, daemon=True).start()
-            
         except Exception as e:
             self.logger.error(f"Failed to start audio recording: {e}")
             raise
@@ -181,66 +207,70 @@ class MuseTalkStreamingClient:
         
         self.logger.info("Stopped audio recording")
     
-    def _record_audio(self):
-        """Record audio in chunks and add to queue"""
-        frames_per_chunk = int(self.sample_rate * self.chunk_duration)
-        
-        while self.is_recording:
-            try:
-                frames = []
-                for _ in range(0, frames_per_chunk, self.chunk_size):
-                    if not self.is_recording:
-                        break
-                    data = self.stream.read(self.chunk_size, exception_on_overflow=False)
-                    frames.append(data)
-                
-                if frames:
-                    # Combine frames into single audio chunk
-                    audio_data = b''.join(frames)
-                    self.audio_queue.put(audio_data)
-                    
-            except Exception as e:
-                self.logger.error(f"Error recording audio: {e}")
-                break
+    def _audio_callback(self, in_data, frame_count, time_info, status):
+        """PyAudio callback: queue each chunk_duration chunk for the event loop"""
+        try:
+            self.loop.call_soon_threadsafe(self._queue_audio, in_data)
+        except RuntimeError:
+            # The event loop was closed without stopping the recording first
+            return (None, pyaudio.paComplete)
+        return (None, pyaudio.paContinue if self.is_recording else pyaudio.paComplete)
+    
+    def _queue_audio(self, audio_data):
+        """Queue an audio chunk, dropping the oldest one if the sender is falling behind"""
+        try:
+            self.audio_queue.put_nowait(audio_data)
+        except asyncio.QueueFull:
+            self.audio_queue.get_nowait()
+            self.audio_queue.put_nowait(audio_data)
+            self.dropped_chunks += 1
+            self.logger.warning(f"Sending falling behind, dropped {self.dropped_chunks} audio chunk(s) so far")
+    
+    def _end_audio_queue(self):
+        """Wake process_audio_queue up and make it return, even if the queue is full"""
+        try:
+            self.audio_queue.put_nowait(None)
+        except asyncio.QueueFull:
+            self.audio_queue.get_nowait()
+            self.audio_queue.put_nowait(None)
     
     async def process_audio_queue(self):
-        """Process audio chunks from queue and send to server"""
+        """Process audio chunks from queue and send to server, until disconnected"""
         while self.is_connected:
             try:
-                if not self.audio_queue.empty():
-                    audio_data = self.audio_queue.get()
-                    
-                    # Encode audio data
-                    audio_base64 = base64.b64encode(audio_data).decode('utf-8')
-                    
-                    # Send to server
-                    message = {
-                        'type': 'audio_chunk',
-                        'audio_data': audio_base64
-                    }
-                    
-                    await self.websocket.send(json.dumps(message))
-                    self.logger.debug("Sent audio chunk to server")
+                audio_data = await self.audio_queue.get()
+                if audio_data is None:
+                    break
                 
-                await asyncio.sleep(0.1)  # Small delay to prevent busy waiting
+                # Send raw audio to server as a binary frame
+                await self.websocket.send(pack_audio_chunk(audio_data))
+                self.logger.debug("Sent audio chunk to server")
                 
             except Exception as e:
                 self.logger.error(f"Error processing audio queue: {e}")
                 break
     
     def get_next_video(self):
-        """Get the next generated video from queue"""
+        """
+        Get the next generated video from queue, as (video_data, timestamp), or None.
+        video_data is a bytes-like memoryview into the received frame.
+        """
         try:
             return self.video_queue.get_nowait()
-        except queue.Empty:
+        except asyncio.QueueEmpty:
             return None
     
+    async def wait_for_video(self):
+        """Wait for the next generated video, as (video_data, timestamp)"""
+        return await self.video_queue.get()
+    
     def save_video(self, video_data, output_path):
-        """Save video data to file"""
+        """Save video data (bytes-like, or a base64 string) to file"""
         try:
-            video_bytes = base64.b64decode(video_data)
+            if isinstance(video_data, str):
+                video_data = base64.b64decode(video_data)
             with open(output_path, 'wb') as f:
-                f.write(video_bytes)
+                f.write(video_data)
             self.logger.info(f"Video saved to: {output_path}")
             return True
         except Exception as e:
@@ -253,7 +283,7 @@ class MuseTalkStreamingClient:
             return None
         
         message = {'type': 'get_status'}
-        await self.websocket.send(json.dumps(message))
+        await self.websocket.send(encode_message(message))
     
     def cleanup(self):
         """Clean up resources"""
@@ -285,27 +315,27 @@ async def main():
         
         # Monitor for generated videos
         video_count = 0
-        start_time = time.time()
+        next_status = time.monotonic() + 10
         
         print("Recording audio and generating videos. Press Ctrl+C to stop...")
         
         while True:
-            # Check for new videos
-            video_result = client.get_next_video()
-            if video_result:
-                video_data, timestamp = video_result
-                video_count += 1
-                
-                # Save video
-                output_path = f"generated_video_{video_count}_{int(timestamp)}.mp4"
-                if client.save_video(video_data, output_path):
-                    print(f"Generated video #{video_count}: {output_path}")
-            
-            # Get status every 10 seconds
-            if int(time.time() - start_time) % 10 == 0:
+            # Wake up for each new video, or to get the status every 10 seconds
+            try:
+                video_data, timestamp = await asyncio.wait_for(
+                    client.wait_for_video(), timeout=max(0, next_status - time.monotonic())
+                )
+            except asyncio.TimeoutError:
                 await client.get_status()
+                next_status += 10
+                continue
+            
+            video_count += 1
             
-            await asyncio.sleep(0.5)
+            # Save video
+            output_path = f"generated_video_{video_count}_{int(timestamp)}.mp4"
+            if client.save_video(video_data, output_path):
+                print(f"Generated video #{video_count}: {output_path}")
     
     except KeyboardInterrupt:
         print("\nStopping client...")
@@ -326,5 +356,6 @@ if __name__ == "__main__":
         print("PyAudio is required for audio recording. Install it with: pip install pyaudio")
         exit(1)
     
-    # Run the client
-    asyncio.run(main())
\ No newline at end of file
+    # Run the client, on uvloop when it is installed
+    run = uvloop.run if uvloop is not None else asyncio.run
+    run(main())
\ No newline at end of file
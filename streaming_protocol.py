@@ -0,0 +1,157 @@
+"""
+Binary WebSocket frames exchanged by the streaming server and client.
+
+Audio and video travel as binary frames whose first byte tags the payload, so they
+are sent as raw bytes instead of base64 inside JSON. Control messages
+(initialize_avatar without data, get_status, status, errors, ...) stay JSON text frames.
+
+    AUDIO_CHUNK   client -> server   tag | raw 16 kHz mono int16 PCM
+    VIDEO_CHUNK   server -> client   tag | uint64 timestamp | MP4
+
+Video timestamps are the server's time.monotonic_ns() when the video was ready; only
+differences between them are meaningful.
+    AVATAR_VIDEO  client -> server   tag | version length | version | MP4
+
+JSON requests from clients are decoded into the typed request classes below, with
+msgspec when it is installed.
+"""
+import json
+import os
+import struct
+from typing import Literal, Optional, Union, get_args, get_origin
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+try:
+    import msgspec
+except ImportError:
+    msgspec = None
+
+AUDIO_CHUNK = 0x01
+VIDEO_CHUNK = 0x02
+AVATAR_VIDEO = 0x03
+
+VIDEO_HEADER = struct.Struct('<BQ')
+
+# MuseTalk versions a client may ask for
+VERSIONS = ('v1', 'v15')
+
+def encode_message(message):
+    """Serialize a control message for a JSON text frame"""
+    if orjson is not None:
+        # orjson produces bytes; websockets would send those as a binary frame
+        return orjson.dumps(message).decode()
+    return json.dumps(message)
+
+def decode_message(message):
+    """Parse a JSON text frame; raises json.JSONDecodeError on invalid JSON"""
+    if orjson is not None:
+        return orjson.loads(message)
+    return json.loads(message)
+
+if msgspec is not None:
+    Request = msgspec.Struct
+    # Raised for invalid JSON as well as for unknown or malformed requests
+    RequestError = msgspec.DecodeError
+else:
+    def _matches(value, annotation):
+        """Whether value fits a field annotation (str, Optional[...] or Literal[...])"""
+        origin = get_origin(annotation)
+        if origin is Literal:
+            return value in get_args(annotation)
+        if origin is Union:
+            return any(_matches(value, arg) for arg in get_args(annotation))
+        if annotation is type(None):
+            return value is None
+        return isinstance(value, annotation)
+    
+    class Request:
+        """
+        Minimal stand-in for msgspec.Struct when msgspec is not installed. Decoded
+        fields are type checked like msgspec does, so both accept the same requests.
+        """
+        
+        def __init_subclass__(cls, tag=None, **kwargs):
+            super().__init_subclass__(**kwargs)
+            cls.tag = tag
+        
+        def __init__(self, **fields):
+            for name, annotation in vars(type(self)).get('__annotations__', {}).items():
+                value = fields.get(name, getattr(type(self), name))
+                if not _matches(value, annotation):
+                    raise RequestError(f"Invalid value for {name}: {value!r}")
+                setattr(self, name, value)
+    
+    RequestError = ValueError
+
+class InitializeAvatar(Request, tag='initialize_avatar'):
+    version: Literal[VERSIONS] = 'v15'
+    avatar_video_data: Optional[str] = None  # base64
+    avatar_video_path: Optional[str] = None
+
+class AudioChunk(Request, tag='audio_chunk'):
+    audio_data: str = ''  # legacy base64 audio
+
+class GetStatus(Request, tag='get_status'):
+    pass
+
+if msgspec is not None:
+    # The 'type' field picks the request class in C, without an intermediate dict
+    _request_decoder = msgspec.json.Decoder(Union[InitializeAvatar, AudioChunk, GetStatus])
+    
+    def decode_request(message):
+        """Decode a JSON request into its request class; raises RequestError"""
+        return _request_decoder.decode(message)
+else:
+    _request_types = {cls.tag: cls for cls in (InitializeAvatar, AudioChunk, GetStatus)}
+    
+    def decode_request(message):
+        """Decode a JSON request into its request class; raises RequestError"""
+        data = decode_message(message)
+        message_type = data.get('type') if isinstance(data, dict) else None
+        request_type = _request_types.get(message_type)
+        if request_type is None:
+            raise RequestError(f"Unknown message type: {message_type}")
+        return request_type(**data)
+
+def pack_audio_chunk(audio_bytes):
+    return bytes([AUDIO_CHUNK]) + audio_bytes
+
+def pack_video_chunk(video_bytes, timestamp):
+    return VIDEO_HEADER.pack(VIDEO_CHUNK, timestamp) + video_bytes
+
+def pack_video_file(path, timestamp):
+    """
+    VIDEO_CHUNK frame for a video file. The frame is preallocated and the file read
+    straight into it after the header, so the video is not copied a second time.
+    """
+    with open(path, 'rb', buffering=0) as f:
+        size = os.fstat(f.fileno()).st_size
+        if hasattr(os, 'posix_fadvise'):
+            # Read ahead aggressively when the scratch dir is disk-backed (no-op on tmpfs)
+            os.posix_fadvise(f.fileno(), 0, size, os.POSIX_FADV_SEQUENTIAL)
+        frame = bytearray(VIDEO_HEADER.size + size)
+        VIDEO_HEADER.pack_into(frame, 0, VIDEO_CHUNK, timestamp)
+        view = memoryview(frame)[VIDEO_HEADER.size:]
+        while view:
+            n = f.readinto(view)
+            if not n:
+                raise EOFError(f"{path} shrank while being read")
+            view = view[n:]
+    return frame
+
+def unpack_video_chunk(frame):
+    """Return (video bytes, timestamp) of a VIDEO_CHUNK frame"""
+    _, timestamp = VIDEO_HEADER.unpack_from(frame)
+    return frame[VIDEO_HEADER.size:], timestamp
+
+def pack_avatar_video(video_bytes, version="v15"):
+    version = version.encode()
+    return bytes([AVATAR_VIDEO, len(version)]) + version + video_bytes
+
+def unpack_avatar_video(frame):
+    """Return (version, video bytes) of an AVATAR_VIDEO frame"""
+    length = frame[1]
+    return bytes(frame[2:2 + length]).decode(), frame[2 + length:]
@@ -1,17 +1,43 @@
 import asyncio
 import websockets
-import json
-import base64
-import tempfile
+try:
+    import pybase64 as base64  # SIMD-accelerated, same API
+except ImportError:
+    import base64
 import os
 import time
-import threading
-import queue
+import concurrent.futures
+import collections
+import itertools
 import logging
 from pathlib import Path
-import wave
+import struct
 import io
-from musetalk_wrapper import MuseTalkWrapper
+import shutil
+import threading
+try:
+    import uvloop
+except ImportError:
+    uvloop = None
+try:
+    from blake3 import blake3 as content_hash  # SIMD-accelerated
+except ImportError:
+    from hashlib import blake2b as content_hash
+from musetalk_wrapper import MuseTalkWrapper, SCRATCH_DIR, new_scratch_dir
+from streaming_protocol import (
+    AUDIO_CHUNK, AVATAR_VIDEO, VERSIONS, AudioChunk, GetStatus, InitializeAvatar, RequestError,
+    decode_request, encode_message, pack_video_file, unpack_avatar_video
+)
+
+# Audio chunks buffered per client; beyond this the oldest are dropped, since stale
+# audio is useless for realtime lipsync and would only add latency
+MAX_QUEUED_CHUNKS = 3
+
+# Uploaded avatar videos, shared by every client using the avatar
+AVATAR_VIDEO_DIR = os.path.join(SCRATCH_DIR, "stream_avatars")
+
+# Canonical 44-byte PCM WAV header
+WAV_HEADER = struct.Struct('<4sI4s4sIHHIIHH4sI')
 
 class MuseTalkStreamingServer:
     """
@@ -23,7 +49,34 @@ class MuseTalkStreamingServer:
         self.host = host
         self.port = port
         self.clients = {}
+        self._client_ids = itertools.count(1)
+        
+        # Prepared avatars keyed by version and video content, shared by all clients
+        # using the same video and cleaned up when the last of them leaves
         self.avatars = {}
+        self.avatar_refs = {}
+        self._avatar_lock = threading.Lock()
+        self._prepare_locks = {}
+        self.loop = None  # Event loop serving the websockets, set by serve_forever
+        
+        # Audio flows through a pipeline: the event loop receives chunks, the inference
+        # pool renders them, the packaging thread reads each video into a frame and the
+        # event loop sends it, so a chunk is packaged and sent while the next one renders.
+        # Inference for all clients shares this bounded pool, one chunk per job
+        self.infer_pool = concurrent.futures.ThreadPoolExecutor(
+            max_workers=min(4, os.cpu_count() or 1),
+            thread_name_prefix="musetalk-stream"
+        )
+        # Avatar preparation runs apart, so it never waits behind busy streams (or they behind it)
+        self.prepare_pool = concurrent.futures.ThreadPoolExecutor(
+            max_workers=2,
+            thread_name_prefix="musetalk-prepare"
+        )
+        # One thread, so every client's videos are sent in the order they were rendered
+        self.package_pool = concurrent.futures.ThreadPoolExecutor(
+            max_workers=1,
+            thread_name_prefix="musetalk-package"
+        )
         
         # Setup logging
         logging.basicConfig(level=logging.INFO)
@@ -33,18 +86,23 @@ class MuseTalkStreamingServer:
     
     async def register_client(self, websocket, path):
         """Handle new client connections"""
-        client_id = f"client_{int(time.time() * 1000)}"
+        client_id = f"client_{next(self._client_ids)}"
         self.clients[client_id] = {
             'websocket': websocket,
             'avatar_id': None,
-            'audio_queue': queue.Queue(),
-            'processing': False
+            # Filled on the event loop, drained by one inference job at a time
+            'audio_queue': collections.deque(maxlen=MAX_QUEUED_CHUNKS),
+            'dropped_chunks': 0,
+            'chunk_ids': itertools.count(1),
+            'processing': False,
+            # Avatar video, audio chunks and generated videos, on tmpfs when available
+            'scratch_dir': new_scratch_dir("streams")
         }
         
         self.logger.info(f"Client {client_id} connected")
         
         try:
-            await websocket.send(json.dumps({
+            await websocket.send(encode_message({
                 'type': 'connection_established',
                 'client_id': client_id,
                 'message': 'Connected to MuseTalk Streaming Server'
@@ -63,95 +121,186 @@ class MuseTalkStreamingServer:
     async def handle_message(self, client_id, message):
         """Handle incoming messages from clients"""
         try:
-            data = json.loads(message)
-            message_type = data.get('type')
+            # Audio and avatar video arrive as tagged binary frames
+            if isinstance(message, bytes):
+                frame = memoryview(message)
+                
+                if frame[0] == AUDIO_CHUNK:
+                    await self.handle_audio_chunk(client_id, frame[1:])
+                
+                elif frame[0] == AVATAR_VIDEO:
+                    version, video_data = unpack_avatar_video(frame)
+                    await self.handle_initialize_avatar(client_id, InitializeAvatar(version=version), video_data)
+                
+                else:
+                    await self.send_error(client_id, f"Unknown binary frame type: {frame[0]}")
+                return
             
-            if message_type == 'initialize_avatar':
-                await self.handle_initialize_avatar(client_id, data)
+            request = decode_request(message)
             
-            elif message_type == 'audio_chunk':
-                await self.handle_audio_chunk(client_id, data)
+            if isinstance(request, InitializeAvatar):
+                await self.handle_initialize_avatar(client_id, request)
             
-            elif message_type == 'get_status':
-                await self.handle_get_status(client_id)
+            elif isinstance(request, AudioChunk):
+                # Legacy base64 audio
+                if not request.audio_data:
+                    await self.send_error(client_id, "No audio data provided")
+                    return
+                await self.handle_audio_chunk(client_id, base64.b64decode(request.audio_data))
             
-            else:
-                await self.send_error(client_id, f"Unknown message type: {message_type}")
+            elif isinstance(request, GetStatus):
+                await self.handle_get_status(client_id)
                 
-        except json.JSONDecodeError:
-            await self.send_error(client_id, "Invalid JSON message")
+        except RequestError as e:
+            await self.send_error(client_id, f"Invalid message: {e}")
         except Exception as e:
             await self.send_error(client_id, f"Error processing message: {e}")
     
-    async def handle_initialize_avatar(self, client_id, data):
-        """Initialize avatar for a client"""
+    async def handle_initialize_avatar(self, client_id, request, video_data=None):
+        """
+        Initialize avatar for a client.
+        The video comes from a binary AVATAR_VIDEO frame (video_data), or from the
+        avatar_video_data (base64) or avatar_video_path fields of an InitializeAvatar request.
+        """
         try:
-            avatar_video_data = data.get('avatar_video_data')
-            avatar_video_path = data.get('avatar_video_path')
-            version = data.get('version', 'v15')
+            avatar_video_data = request.avatar_video_data
+            avatar_video_path = request.avatar_video_path
+            version = request.version
+            
+            # Decoded JSON requests are already checked; binary AVATAR_VIDEO frames are not
+            if version not in VERSIONS:
+                await self.send_error(client_id, f"Invalid version: {version!r}. Must be one of {', '.join(VERSIONS)}")
+                return
             
-            if not avatar_video_data and not avatar_video_path:
+            if video_data is None and not avatar_video_data and not avatar_video_path:
                 await self.send_error(client_id, "Either avatar_video_data or avatar_video_path must be provided")
                 return
             
-            # If video data is provided, save it to a temporary file
             if avatar_video_data:
                 video_data = base64.b64decode(avatar_video_data)
-                temp_video = tempfile.NamedTemporaryFile(suffix='.mp4', delete=False)
-                temp_video.write(video_data)
-                temp_video.close()
-                avatar_video_path = temp_video.name
             
             # Validate video path
-            if not os.path.exists(avatar_video_path):
+            if video_data is None and not os.path.exists(avatar_video_path):
                 await self.send_error(client_id, f"Avatar video not found: {avatar_video_path}")
                 return
             
-            # Create avatar wrapper
-            avatar_id = f"avatar_{client_id}_{int(time.time())}"
-            
-            await self.send_message(client_id, {
-                'type': 'avatar_initialization_started',
-                'avatar_id': avatar_id,
-                'message': 'Initializing avatar, this may take a few moments...'
-            })
-            
-            # Initialize avatar in a separate thread to avoid blocking
+            # Hash and prepare the avatar in the background to avoid blocking
             def initialize_avatar():
                 try:
-                    wrapper = MuseTalkWrapper(
-                        avatar_video_path=avatar_video_path,
-                        musetalk_project_path=".",
-                        version=version
-                    )
+                    avatar_id = self.acquire_avatar(client_id, version, video_data, avatar_video_path)
                     
-                    # Prepare avatar for real-time inference
-                    success = wrapper.prepare_avatar_realtime()
-                    
-                    if success:
-                        self.avatars[avatar_id] = wrapper
-                        self.clients[client_id]['avatar_id'] = avatar_id
-                        
-                        # Send success message
-                        asyncio.create_task(self.send_message(client_id, {
-                            'type': 'avatar_initialized',
-                            'avatar_id': avatar_id,
-                            'message': 'Avatar initialized successfully. Ready to process audio.'
-                        }))
+                    if avatar_id:
+                        self.loop.call_soon_threadsafe(self.attach_avatar, client_id, avatar_id)
                     else:
-                        asyncio.create_task(self.send_error(client_id, "Failed to initialize avatar"))
+                        self.send_threadsafe(self.send_error(client_id, "Failed to initialize avatar"))
                         
                 except Exception as e:
-                    asyncio.create_task(self.send_error(client_id, f"Avatar initialization error: {e}"))
+                    self.send_threadsafe(self.send_error(client_id, f"Avatar initialization error: {e}"))
             
             # Start initialization in background
-            threading.Thread(target=initialize_avatar, daemon=True).start()
+            self.loop.run_in_executor(self.prepare_pool, initialize_avatar)
             
         except Exception as e:
             await self.send_error(client_id, f"Error initializing avatar: {e}")
     
-    async def handle_audio_chunk(self, client_id, data):
-        """Handle incoming audio chunk"""
+    def acquire_avatar(self, client_id, version, video_data, avatar_video_path):
+        """
+        Take a reference to the prepared avatar for a video, preparing it first unless
+        another client already did. Runs on the inference pool.
+        
+        Returns:
+        - avatar_id, or None if preparation failed
+        """
+        hasher = content_hash()
+        if video_data is not None:
+            hasher.update(video_data)
+        else:
+            with open(avatar_video_path, 'rb') as f:
+                for block in iter(lambda: f.read(1 << 20), b''):
+                    hasher.update(block)
+        avatar_id = f"avatar_{version}_{hasher.hexdigest()[:16]}"
+        
+        # Clients sending the same video wait for a single preparation
+        with self._avatar_lock:
+            prepare_lock = self._prepare_locks.setdefault(avatar_id, threading.Lock())
+        
+        with prepare_lock:
+            with self._avatar_lock:
+                if avatar_id in self.avatars:
+                    self.avatar_refs[avatar_id] += 1
+                    self.logger.info(f"Reusing prepared avatar {avatar_id} for client {client_id}")
+                    return avatar_id
+            
+            self.send_threadsafe(self.send_message(client_id, {
+                'type': 'avatar_initialization_started',
+                'avatar_id': avatar_id,
+                'message': 'Initializing avatar, this may take a few moments...'
+            }))
+            
+            # Uploaded videos are kept for as long as any client uses the avatar
+            if video_data is not None:
+                os.makedirs(AVATAR_VIDEO_DIR, exist_ok=True)
+                avatar_video_path = os.path.join(AVATAR_VIDEO_DIR, f"{avatar_id}.mp4")
+                with open(avatar_video_path, 'wb') as f:
+                    f.write(video_data)
+            
+            wrapper = MuseTalkWrapper(
+                avatar_video_path=avatar_video_path,
+                musetalk_project_path=".",
+                version=version
+            )
+            
+            # Prepare avatar for real-time inference
+            if not wrapper.prepare_avatar_realtime():
+                wrapper.cleanup()
+                if video_data is not None:
+                    os.unlink(avatar_video_path)
+                return None
+            
+            with self._avatar_lock:
+                self.avatars[avatar_id] = wrapper
+                self.avatar_refs[avatar_id] = 1
+            return avatar_id
+    
+    def release_avatar(self, avatar_id):
+        """Drop a client's reference to an avatar, cleaning it up after the last one"""
+        with self._avatar_lock:
+            self.avatar_refs[avatar_id] -= 1
+            if self.avatar_refs[avatar_id] > 0:
+                return
+            
+            del self.avatar_refs[avatar_id]
+            wrapper = self.avatars.pop(avatar_id)
+        
+        wrapper.cleanup()
+        try:
+            os.unlink(os.path.join(AVATAR_VIDEO_DIR, f"{avatar_id}.mp4"))
+        except FileNotFoundError:
+            pass
+        self.logger.info(f"Cleaned up avatar {avatar_id}")
+    
+    def attach_avatar(self, client_id, avatar_id):
+        """Called on the event loop once a client's avatar is ready"""
+        client = self.clients.get(client_id)
+        if client is None:
+            # Disconnected while the avatar was being prepared
+            self.release_avatar(avatar_id)
+            return
+        
+        previous = client['avatar_id']
+        client['avatar_id'] = avatar_id
+        if previous:
+            self.release_avatar(previous)
+        
+        # Send success message
+        self.loop.create_task(self.send_message(client_id, {
+            'type': 'avatar_initialized',
+            'avatar_id': avatar_id,
+            'message': 'Avatar initialized successfully. Ready to process audio.'
+        }))
+    
+    async def handle_audio_chunk(self, client_id, audio_bytes):
+        """Handle an incoming chunk of raw PCM audio"""
         try:
             if client_id not in self.clients:
                 await self.send_error(client_id, "Client not found")
@@ -162,97 +311,113 @@ class MuseTalkStreamingServer:
                 await self.send_error(client_id, "Avatar not initialized")
                 return
             
-            audio_data = data.get('audio_data')
-            if not audio_data:
+            if not audio_bytes:
                 await self.send_error(client_id, "No audio data provided")
                 return
             
-            # Decode audio data
-            audio_bytes = base64.b64decode(audio_data)
+            # The WAV header written for inference assumes whole 16-bit samples
+            if len(audio_bytes) % 2:
+                await self.send_error(client_id, "Audio must be 16-bit PCM")
+                return
             
             # Add to processing queue
-            self.clients[client_id]['audio_queue'].put(audio_bytes)
+            client = self.clients[client_id]
+            if len(client['audio_queue']) == MAX_QUEUED_CHUNKS:
+                # The deque drops the oldest chunk on append
+                client['dropped_chunks'] += 1
+                self.logger.warning(
+                    f"Inference falling behind for client {client_id}, "
+                    f"dropped {client['dropped_chunks']} audio chunk(s) so far"
+                )
+            client['audio_queue'].append(audio_bytes)
             
-            # Start processing if not already processing
+            # Start processing if not already processing; one job per client keeps
+            # its chunks in order, the shared pool bounds concurrency across clients
             if not self.clients[client_id]['processing']:
                 self.clients[client_id]['processing'] = True
-                threading.Thread(
-                    target=self.process_audio_queue,
-                    args=(client_id, avatar_id),
-                    daemon=True
-                ).start()
+                self.loop.run_in_executor(self.infer_pool, self.process_audio_queue, client_id, avatar_id)
             
-            await self.send_message(client_id, {
-                'type': 'audio_received',
-                'message': 'Audio chunk received and queued for processing'
-            })
+            # No per-chunk acknowledgement: the video generated from it (or an error) follows,
+            # and queue_size/dropped_chunks are available through get_status
             
         except Exception as e:
             await self.send_error(client_id, f"Error handling audio chunk: {e}")
     
     def process_audio_queue(self, client_id, avatar_id):
-        """Process audio chunks in queue"""
+        """
+        Process the oldest queued audio chunk. Each job renders a single chunk and
+        finish_processing queues the next one behind every other client's, so clients
+        take turns on the pool even when inference is slower than real time.
+        """
         try:
             wrapper = self.avatars[avatar_id]
-            audio_queue = self.clients[client_id]['audio_queue']
+            client = self.clients[client_id]
+            audio_bytes = client['audio_queue'].popleft()
+            # A client has at most one job at a time, so one audio file is rewritten per chunk
+            audio_path = os.path.join(client['scratch_dir'], 'chunk.wav')
             
-            while not audio_queue.empty():
-                try:
-                    audio_bytes = audio_queue.get(timeout=1)
-                    
-                    # Save audio to temporary file
-                    temp_audio = tempfile.NamedTemporaryFile(suffix='.wav', delete=False)
-                    
-                    # Convert raw audio bytes to WAV format
-                    self.save_audio_as_wav(audio_bytes, temp_audio.name)
-                    
-                    # Generate video
-                    output_name = f"stream_{client_id}_{int(time.time() * 1000)}"
-                    video_path = wrapper.generate_video_from_audio(temp_audio.name, output_name)
-                    
-                    if video_path and os.path.exists(video_path):
-                        # Read generated video
-                        with open(video_path, 'rb') as f:
-                            video_data = f.read()
-                        
-                        # Encode video as base64
-                        video_base64 = base64.b64encode(video_data).decode('utf-8')
-                        
-                        # Send video to client
-                        asyncio.create_task(self.send_message(client_id, {
-                            'type': 'video_chunk',
-                            'video_data': video_base64,
-                            'timestamp': time.time()
-                        }))
-                        
-                        # Clean up generated video
-                        os.unlink(video_path)
-                    else:
-                        asyncio.create_task(self.send_error(client_id, "Failed to generate video"))
-                    
-                    # Clean up temporary audio
-                    os.unlink(temp_audio.name)
-                    
-                except queue.Empty:
-                    break
-                except Exception as e:
-                    self.logger.error(f"Error processing audio for client {client_id}: {e}")
-                    asyncio.create_task(self.send_error(client_id, f"Audio processing error: {e}"))
+            # Convert raw audio bytes to WAV format
+            self.save_audio_as_wav(audio_bytes, audio_path)
+            
+            # Generate video
+            output_name = f"stream_{client_id}_{next(client['chunk_ids'])}"
+            video_path = wrapper.generate_video_from_audio(audio_path, output_name, result_dir=client['scratch_dir'])
+            
+            if video_path and os.path.exists(video_path):
+                # Hand the video to the packaging stage and move on to the next chunk
+                self.package_pool.submit(self.send_video, client_id, video_path)
+            else:
+                self.send_threadsafe(self.send_error(client_id, "Failed to generate video"))
             
         except Exception as e:
-            self.logger.error(f"Error in audio processing thread for client {client_id}: {e}")
+            self.logger.error(f"Error processing audio for client {client_id}: {e}")
+            self.send_threadsafe(self.send_error(client_id, f"Audio processing error: {e}"))
         finally:
-            if client_id in self.clients:
-                self.clients[client_id]['processing'] = False
+            self.loop.call_soon_threadsafe(self.finish_processing, client_id, avatar_id)
+    
+    def finish_processing(self, client_id, avatar_id):
+        """
+        Called on the event loop after each processing job. If more chunks are queued,
+        the next job goes to the back of the pool's queue, behind other clients' jobs.
+        """
+        client = self.clients.get(client_id)
+        if client is None:
+            return
+        
+        if client['audio_queue'] and avatar_id in self.avatars:
+            self.loop.run_in_executor(self.infer_pool, self.process_audio_queue, client_id, avatar_id)
+        else:
+            client['processing'] = False
+    
+    def send_video(self, client_id, video_path):
+        """Packaging stage: read a generated video into a binary frame, send it and remove the file"""
+        try:
+            # Read generated video straight into a binary frame and send it
+            self.send_threadsafe(self.send_frame(
+                client_id, pack_video_file(video_path, time.monotonic_ns())
+            ))
+        except Exception as e:
+            self.logger.error(f"Error sending video to client {client_id}: {e}")
+            self.send_threadsafe(self.send_error(client_id, f"Audio processing error: {e}"))
+        finally:
+            # Clean up generated video; the client's scratch dir may already be gone
+            try:
+                os.unlink(video_path)
+            except FileNotFoundError:
+                pass
     
     def save_audio_as_wav(self, audio_bytes, output_path, sample_rate=16000, channels=1, sample_width=2):
         """Save raw audio bytes as WAV file"""
         try:
-            with wave.open(output_path, 'wb') as wav_file:
-                wav_file.setnchannels(channels)
-                wav_file.setsampwidth(sample_width)
-                wav_file.setframerate(sample_rate)
-                wav_file.writeframes(audio_bytes)
+            header = WAV_HEADER.pack(
+                b'RIFF', 36 + len(audio_bytes), b'WAVE',
+                b'fmt ', 16, 1, channels, sample_rate,
+                sample_rate * channels * sample_width, channels * sample_width, sample_width * 8,
+                b'data', len(audio_bytes)
+            )
+            with open(output_path, 'wb') as f:
+                f.write(header)
+                f.write(audio_bytes)
         except Exception as e:
             self.logger.error(f"Error saving audio as WAV: {e}")
             raise
@@ -272,7 +437,8 @@ class MuseTalkStreamingServer:
                 'client_id': client_id,
                 'avatar_initialized': avatar_id is not None,
                 'avatar_id': avatar_id,
-                'queue_size': client_info['audio_queue'].qsize(),
+                'queue_size': len(client_info['audio_queue']),
+                'dropped_chunks': client_info['dropped_chunks'],
                 'processing': client_info['processing']
             }
             
@@ -286,10 +452,22 @@ class MuseTalkStreamingServer:
         try:
             if client_id in self.clients:
                 websocket = self.clients[client_id]['websocket']
-                await websocket.send(json.dumps(message))
+                await websocket.send(encode_message(message))
         except Exception as e:
             self.logger.error(f"Error sending message to client {client_id}: {e}")
     
+    async def send_frame(self, client_id, frame):
+        """Send a binary frame to specific client"""
+        try:
+            if client_id in self.clients:
+                await self.clients[client_id]['websocket'].send(frame)
+        except Exception as e:
+            self.logger.error(f"Error sending frame to client {client_id}: {e}")
+    
+    def send_threadsafe(self, coro):
+        """Schedule a send coroutine on the server's event loop from a worker thread"""
+        return asyncio.run_coroutine_threadsafe(coro, self.loop)
+    
     async def send_error(self, client_id, error_message):
         """Send error message to client"""
         await self.send_message(client_id, {
@@ -303,12 +481,12 @@ class MuseTalkStreamingServer:
             if client_id in self.clients:
                 avatar_id = self.clients[client_id]['avatar_id']
                 
-                # Clean up avatar if it exists
-                if avatar_id and avatar_id in self.avatars:
-                    self.avatars[avatar_id].cleanup()
-                    del self.avatars[avatar_id]
+                # Release the avatar; it is cleaned up once no client uses it
+                if avatar_id:
+                    self.release_avatar(avatar_id)
                 
                 # Remove client
+                shutil.rmtree(self.clients[client_id]['scratch_dir'], ignore_errors=True)
                 del self.clients[client_id]
                 
                 self.logger.info(f"Cleaned up resources for client {client_id}")
@@ -316,22 +494,30 @@ class MuseTalkStreamingServer:
         except Exception as e:
             self.logger.error(f"Error cleaning up client {client_id}: {e}")
     
-    def start_server(self):
-        """Start the WebSocket server"""
-        self.logger.info(f"Starting MuseTalk Streaming Server on {self.host}:{self.port}")
+    async def serve_forever(self):
+        """Serve websocket clients until cancelled"""
+        self.loop = asyncio.get_running_loop()
         
-        start_server = websockets.serve(
+        async with websockets.serve(
             self.register_client,
             self.host,
             self.port,
             max_size=50 * 1024 * 1024,  # 50MB max message size for video data
             ping_interval=20,
-            ping_timeout=10
-        )
+            ping_timeout=10,
+            # Raw PCM barely deflates and MP4 is already compressed; deflate only burns CPU
+            compression=None,
+            write_limit=2 ** 22  # Buffer whole multi-MB frames before pausing the sender
+        ):
+            self.logger.info("Server started successfully")
+            await asyncio.Future()
+    
+    def start_server(self):
+        """Start the WebSocket server, on uvloop when it is installed"""
+        self.logger.info(f"Starting MuseTalk Streaming Server on {self.host}:{self.port}")
         
-        asyncio.get_event_loop().run_until_complete(start_server)
-        self.logger.info("Server started successfully")
-        asyncio.get_event_loop().run_forever()
+        run = uvloop.run if uvloop is not None else asyncio.run
+        run(self.serve_forever())
 
 if __name__ == "__main__":
     # Create and start the server
@@ -7,52 +7,114 @@ This script tests all components of the streaming system to ensure everything wo
 import os
 import sys
 import time
-import tempfile
 import subprocess
+import threading
+import contextlib
+import struct
+import concurrent.futures
 import requests
-import json
-import asyncio
-import websockets
-import base64
+from requests.adapters import HTTPAdapter
+from websocket import WebSocketTimeoutException, create_connection
 import logging
 from pathlib import Path
+from streaming_protocol import VIDEO_CHUNK, decode_message, pack_audio_chunk, pack_avatar_video, unpack_video_chunk
 
 # Setup logging
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
 logger = logging.getLogger(__name__)
 
+def is_mp4(data):
+    """
+    Check that data is a complete MP4: a run of top-level boxes that starts with
+    ftyp, contains moov and exactly covers the data. Catches empty, truncated and
+    non-MP4 outputs without decoding them.
+    """
+    data = memoryview(data)
+    offset, box_types = 0, set()
+    while offset + 8 <= len(data):
+        size, box_type = struct.unpack_from('>I4s', data, offset)
+        if size == 1:
+            # 64-bit box size follows the type
+            if offset + 16 > len(data):
+                return False
+            size, = struct.unpack_from('>Q', data, offset + 8)
+        elif size == 0:
+            # Box extends to the end of the file
+            size = len(data) - offset
+        if size < 8 or (offset == 0 and box_type != b'ftyp'):
+            return False
+        box_types.add(box_type)
+        offset += size
+    return offset == len(data) and b'moov' in box_types
+
+def iter_chunks(path, chunk_size=1 << 20):
+    """Yield a file in chunks, for streaming it as a request body"""
+    with open(path, 'rb') as f:
+        while chunk := f.read(chunk_size):
+            yield chunk
+
 class StreamingSystemTester:
     """Test suite for the MuseTalk streaming system"""
     
     def __init__(self):
         self.test_results = {}
+        self._stat_cache = {}
+        self._results_lock = threading.Lock()
         self.api_server_url = "http://localhost:5000"
         self.websocket_url = "ws://localhost:8765"
         
-        # Test files (using MuseTalk's default test data)
+        # Test files (using MuseTalk's default test data); every test needs them,
+        # so fail before any test runs if one is missing
         self.test_video = "data/video/yongen.mp4"
         self.test_audio = "data/audio/yongen.wav"
+        for path in (self.test_video, self.test_audio):
+            self.stat_input(path)  # Raises FileNotFoundError
+        
+        # One keep-alive connection pool for every API request
+        self.session = requests.Session()
+        self.session.mount('http://', HTTPAdapter(pool_connections=4, pool_maxsize=8))
+        
+        # Output sink shared by any servers the tests start
+        self._devnull = open(os.devnull, 'wb')
         
         logger.info("MuseTalk Streaming System Tester initialized")
     
     def run_all_tests(self):
-        """Run all tests in sequence"""
+        """Run all tests"""
         logger.info("Starting comprehensive test suite...")
         
-        # Test 1: Basic wrapper functionality
-        self.test_wrapper_basic()
-        
-        # Test 2: API server functionality
-        self.test_api_server()
-        
-        # Test 3: WebSocket server functionality
-        asyncio.run(self.test_websocket_server())
+        # The tests exercise independent components and mostly wait on generation,
+        # so they run concurrently
+        try:
+            with concurrent.futures.ThreadPoolExecutor(max_workers=3) as executor:
+                futures = [
+                    executor.submit(self.test_wrapper_basic),  # Test 1: Basic wrapper functionality
+                    executor.submit(self.test_api_server),  # Test 2: API server functionality
+                    executor.submit(self.test_websocket_server)  # Test 3: WebSocket server functionality
+                ]
+                for future in futures:
+                    future.result()
+        finally:
+            self.session.close()
+            self._devnull.close()
         
         # Print results
         self.print_test_results()
         
         return all(self.test_results.values())
     
+    def stat_input(self, path):
+        """os.stat of a test input file, cached since the inputs do not change during a run"""
+        stat = self._stat_cache.get(path)
+        if stat is None:
+            stat = self._stat_cache[path] = os.stat(path)
+        return stat
+    
+    def record_result(self, test_name, passed):
+        """Record a test result; tests run on several threads"""
+        with self._results_lock:
+            self.test_results[test_name] = passed
+    
     def test_wrapper_basic(self):
         """Test basic wrapper functionality"""
         logger.info("Testing MuseTalkWrapper basic functionality...")
@@ -60,17 +122,6 @@ class StreamingSystemTester:
         try:
             from musetalk_wrapper import MuseTalkWrapper
             
-            # Check if test files exist
-            if not os.path.exists(self.test_video):
-                logger.error(f"Test video not found: {self.test_video}")
-                self.test_results['wrapper_basic'] = False
-                return
-            
-            if not os.path.exists(self.test_audio):
-                logger.error(f"Test audio not found: {self.test_audio}")
-                self.test_results['wrapper_basic'] = False
-                return
-            
             # Initialize wrapper
             wrapper = MuseTalkWrapper(
                 avatar_video_path=self.test_video,
@@ -86,17 +137,17 @@ class StreamingSystemTester:
             
             if video_path and os.path.exists(video_path):
                 logger.info(f"Video generated successfully: {video_path}")
-                file_size = os.path.getsize(video_path)
-                logger.info(f"Generated video size: {file_size} bytes")
+                video_bytes = Path(video_path).read_bytes()
+                logger.info(f"Generated video size: {len(video_bytes)} bytes")
                 
-                if file_size > 1000:  # Basic sanity check
-                    self.test_results['wrapper_basic'] = True
+                if is_mp4(video_bytes):
+                    self.record_result('wrapper_basic', True)
                     logger.info("✓ Wrapper basic test PASSED")
                 else:
-                    self.test_results['wrapper_basic'] = False
-                    logger.error("✗ Generated video file too small")
+                    self.record_result('wrapper_basic', False)
+                    logger.error("✗ Generated video is not a valid MP4")
             else:
-                self.test_results['wrapper_basic'] = False
+                self.record_result('wrapper_basic', False)
                 logger.error("✗ Video generation failed")
             
             # Cleanup
@@ -104,103 +155,83 @@ class StreamingSystemTester:
             
         except Exception as e:
             logger.error(f"✗ Wrapper basic test FAILED: {e}")
-            self.test_results['wrapper_basic'] = False
+            self.record_result('wrapper_basic', False)
     
     def test_api_server(self):
         """Test API server functionality"""
         logger.info("Testing API Server functionality...")
         
         try:
-            # Check if server is running
-            try:
-                response = requests.get(f"{self.api_server_url}/health", timeout=5)
-                if response.status_code != 200:
-                    logger.warning("API server not running, attempting to start...")
-                    self.start_api_server()
-                    time.sleep(5)  # Wait for server to start
-            except requests.exceptions.ConnectionError:
-                logger.warning("API server not running, attempting to start...")
-                self.start_api_server()
-                time.sleep(5)  # Wait for server to start
-            
-            # Test health endpoint
-            response = requests.get(f"{self.api_server_url}/health", timeout=10)
-            if response.status_code == 200:
-                logger.info("✓ Health endpoint working")
-            else:
-                raise Exception(f"Health endpoint failed: {response.status_code}")
-            
-            # Test avatar initialization
-            if not os.path.exists(self.test_video):
-                raise Exception(f"Test video not found: {self.test_video}")
-            
-            with open(self.test_video, 'rb') as f:
-                files = {'avatar_video': f}
-                data = {'avatar_id': 'test_avatar_api', 'version': 'v15'}
-                response = requests.post(f"{self.api_server_url}/initialize_avatar", 
-                                       files=files, data=data, timeout=60)
-            
-            if response.status_code == 200:
-                result = response.json()
-                if result.get('status') == 'success':
-                    logger.info("✓ Avatar initialization working")
+            with self.api_client() as (client, base_url, body_arg):
+                # Test health endpoint
+                response = client.get(f"{base_url}/health", timeout=10)
+                if response.status_code == 200:
+                    logger.info("✓ Health endpoint working")
                 else:
-                    raise Exception(f"Avatar initialization failed: {result}")
-            else:
-                raise Exception(f"Avatar initialization request failed: {response.status_code}")
-            
-            # Test video generation
-            if not os.path.exists(self.test_audio):
-                raise Exception(f"Test audio not found: {self.test_audio}")
-            
-            with open(self.test_audio, 'rb') as f:
-                files = {'audio_file': f}
-                data = {'avatar_id': 'test_avatar_api', 'output_name': 'api_test_output'}
-                response = requests.post(f"{self.api_server_url}/generate_video",
-                                       files=files, data=data, timeout=120)
-            
-            if response.status_code == 200:
-                # Save the video to verify
-                test_output_path = "api_test_output.mp4"
-                with open(test_output_path, 'wb') as f:
-                    f.write(response.content)
+                    raise Exception(f"Health endpoint failed: {response.status_code}")
                 
-                file_size = os.path.getsize(test_output_path)
-                logger.info(f"✓ Video generation working (size: {file_size} bytes)")
+                # Test avatar initialization
+                # Raw octet-stream bodies are streamed from the file in 1 MiB chunks, with no
+                # multipart encoding; parameters travel as X-* headers
+                headers = {'Content-Type': 'application/octet-stream', 'X-Avatar-Id': 'test_avatar_api',
+                           'X-Version': 'v15', 'X-Filename': os.path.basename(self.test_video)}
+                response = client.post(f"{base_url}/initialize_avatar",
+                                       **{body_arg: iter_chunks(self.test_video)}, headers=headers, timeout=60)
                 
-                # Cleanup
-                os.unlink(test_output_path)
+                if response.status_code == 200:
+                    result = response.json()
+                    if result.get('status') == 'success':
+                        logger.info("✓ Avatar initialization working")
+                    else:
+                        raise Exception(f"Avatar initialization failed: {result}")
+                else:
+                    raise Exception(f"Avatar initialization request failed: {response.status_code}")
                 
-                self.test_results['api_server'] = True
-                logger.info("✓ API Server test PASSED")
-            else:
-                raise Exception(f"Video generation request failed: {response.status_code}")
+                # Test video generation
+                headers = {'Content-Type': 'application/octet-stream', 'X-Avatar-Id': 'test_avatar_api',
+                           'X-Output-Name': 'api_test_output', 'X-Wait': 'true',
+                           'X-Filename': os.path.basename(self.test_audio)}
+                response = client.post(f"{base_url}/generate_video",
+                                       **{body_arg: iter_chunks(self.test_audio)}, headers=headers, timeout=120)
+                
+                if response.status_code == 200:
+                    if not is_mp4(response.content):
+                        raise Exception("Generated video is not a valid MP4")
+                    
+                    file_size = len(response.content)
+                    logger.info(f"✓ Video generation working (size: {file_size} bytes)")
+                    
+                    self.record_result('api_server', True)
+                    logger.info("✓ API Server test PASSED")
+                else:
+                    raise Exception(f"Video generation request failed: {response.status_code}")
         
         except Exception as e:
             logger.error(f"✗ API Server test FAILED: {e}")
-            self.test_results['api_server'] = False
+            self.record_result('api_server', False)
     
-    async def test_websocket_server(self):
+    def test_websocket_server(self):
         """Test WebSocket server functionality"""
         logger.info("Testing WebSocket Server functionality...")
         
         try:
             # Check if WebSocket server is running
             try:
-                websocket = await websockets.connect(self.websocket_url, timeout=5)
-                await websocket.close()
+                create_connection(self.websocket_url, timeout=5).close()
             except Exception:
                 logger.warning("WebSocket server not running, attempting to start...")
                 self.start_websocket_server()
-                await asyncio.sleep(5)  # Wait for server to start
+                if not self.wait_ready(lambda: create_connection(self.websocket_url, timeout=1).close()):
+                    raise Exception("WebSocket server did not start")
             
-            # Connect to WebSocket server
-            async with websockets.connect(self.websocket_url, timeout=10) as websocket:
+            # Connect to WebSocket server; the single sequential connection needs no event loop
+            websocket = create_connection(self.websocket_url, timeout=10, skip_utf8_validation=True)
+            try:
                 logger.info("✓ WebSocket connection established")
                 
                 # Wait for connection message
-                message = await websocket.recv()
-                data = json.loads(message)
+                message = websocket.recv()
+                data = decode_message(message)
                 
                 if data.get('type') == 'connection_established':
                     client_id = data.get('client_id')
@@ -209,29 +240,16 @@ class StreamingSystemTester:
                     raise Exception(f"Unexpected connection message: {data}")
                 
                 # Test avatar initialization
-                if not os.path.exists(self.test_video):
-                    raise Exception(f"Test video not found: {self.test_video}")
-                
-                with open(self.test_video, 'rb') as f:
-                    video_data = base64.b64encode(f.read()).decode()
-                
-                init_message = {
-                    'type': 'initialize_avatar',
-                    'avatar_video_data': video_data,
-                    'version': 'v15'
-                }
-                
-                await websocket.send(json.dumps(init_message))
+                video_data = Path(self.test_video).read_bytes()
+                websocket.send_binary(pack_avatar_video(video_data, 'v15'))
                 logger.info("Avatar initialization request sent")
                 
                 # Wait for initialization response (this may take time)
-                timeout_count = 0
-                max_timeout = 60  # 60 seconds timeout
+                deadline = time.monotonic() + 60  # 60 seconds timeout
                 
-                while timeout_count < max_timeout:
-                    try:
-                        message = await asyncio.wait_for(websocket.recv(), timeout=1.0)
-                        data = json.loads(message)
+                try:
+                    while True:
+                        data = decode_message(self.recv_before(websocket, deadline))
                         
                         if data.get('type') == 'avatar_initialized':
                             logger.info("✓ Avatar initialization completed")
@@ -240,96 +258,110 @@ class StreamingSystemTester:
                             raise Exception(f"Avatar initialization error: {data.get('message')}")
                         else:
                             logger.info(f"Received: {data.get('type', 'unknown')}")
-                    
-                    except asyncio.TimeoutError:
-                        timeout_count += 1
-                        if timeout_count % 10 == 0:
-                            logger.info(f"Waiting for avatar initialization... ({timeout_count}s)")
-                
-                if timeout_count >= max_timeout:
+                except WebSocketTimeoutException:
                     raise Exception("Avatar initialization timed out")
                 
                 # Test audio processing
-                if not os.path.exists(self.test_audio):
-                    raise Exception(f"Test audio not found: {self.test_audio}")
-                
-                with open(self.test_audio, 'rb') as f:
-                    audio_data = base64.b64encode(f.read()).decode()
-                
-                audio_message = {
-                    'type': 'audio_chunk',
-                    'audio_data': audio_data
-                }
-                
-                await websocket.send(json.dumps(audio_message))
+                audio_data = Path(self.test_audio).read_bytes()
+                websocket.send_binary(pack_audio_chunk(audio_data))
                 logger.info("Audio chunk sent")
                 
                 # Wait for video response
-                timeout_count = 0
-                max_timeout = 120  # 2 minutes timeout for video generation
+                deadline = time.monotonic() + 120  # 2 minutes timeout for video generation
                 
-                while timeout_count < max_timeout:
-                    try:
-                        message = await asyncio.wait_for(websocket.recv(), timeout=1.0)
-                        data = json.loads(message)
+                try:
+                    while True:
+                        message = self.recv_before(websocket, deadline)
                         
-                        if data.get('type') == 'video_chunk':
-                            video_data = data.get('video_data')
-                            if video_data:
-                                # Save video to verify
-                                video_bytes = base64.b64decode(video_data)
-                                test_output_path = "websocket_test_output.mp4"
-                                
-                                with open(test_output_path, 'wb') as f:
-                                    f.write(video_bytes)
+                        # Videos arrive as binary frames
+                        if isinstance(message, bytes) and message[0] == VIDEO_CHUNK:
+                            # Slice through a memoryview so the video is not copied out of the frame
+                            video_bytes, _ = unpack_video_chunk(memoryview(message))
+                            if video_bytes:
+                                if not is_mp4(video_bytes):
+                                    raise Exception("Generated video is not a valid MP4")
                                 
-                                file_size = os.path.getsize(test_output_path)
+                                file_size = len(video_bytes)
                                 logger.info(f"✓ Video generation working (size: {file_size} bytes)")
                                 
-                                # Cleanup
-                                os.unlink(test_output_path)
-                                
-                                self.test_results['websocket_server'] = True
+                                self.record_result('websocket_server', True)
                                 logger.info("✓ WebSocket Server test PASSED")
                                 return
                             else:
                                 raise Exception("Received empty video data")
                         
-                        elif data.get('type') == 'error':
+                        data = decode_message(message)
+                        if data.get('type') == 'error':
                             raise Exception(f"Video generation error: {data.get('message')}")
                         
                         else:
                             logger.info(f"Received: {data.get('type', 'unknown')}")
-                    
-                    except asyncio.TimeoutError:
-                        timeout_count += 1
-                        if timeout_count % 30 == 0:
-                            logger.info(f"Waiting for video generation... ({timeout_count}s)")
-                
-                if timeout_count >= max_timeout:
+                except WebSocketTimeoutException:
                     raise Exception("Video generation timed out")
+            finally:
+                websocket.close()
         
         except Exception as e:
             logger.error(f"✗ WebSocket Server test FAILED: {e}")
-            self.test_results['websocket_server'] = False
+            self.record_result('websocket_server', False)
+    
+    def recv_before(self, websocket, deadline):
+        """
+        Block until the next message arrives, or raise WebSocketTimeoutException once
+        the time.monotonic() deadline passes. One recv per message, no polling.
+        """
+        websocket.settimeout(max(deadline - time.monotonic(), 0.01))
+        return websocket.recv()
     
-    def start_api_server(self):
-        """Start API server in background"""
+    @contextlib.contextmanager
+    def api_client(self):
+        """
+        HTTP client and base URL for the API test: the running API server if there is one,
+        otherwise the app driven in-process, sharing this process's imports and inference
+        workers instead of starting a second server that loads everything again.
+        Also yields the keyword that takes a streamed request body: requests uses data=,
+        while the httpx-based TestClient deprecates that in favour of content=.
+        """
         try:
-            logger.info("Starting API server...")
-            subprocess.Popen([sys.executable, "api_server.py"], 
-                           stdout=subprocess.DEVNULL, 
-                           stderr=subprocess.DEVNULL)
-        except Exception as e:
-            logger.error(f"Failed to start API server: {e}")
+            running = self.session.get(f"{self.api_server_url}/health", timeout=5).status_code == 200
+        except requests.exceptions.ConnectionError:
+            running = False
+        
+        if running:
+            yield self.session, self.api_server_url, 'data'
+            return
+        
+        logger.warning("API server not running, testing the app in-process...")
+        from fastapi.testclient import TestClient
+        from api_server import app
+        
+        # Not entered as a context manager: the app's shutdown handler would stop the
+        # worker pools the other tests are still using
+        yield TestClient(app), "", 'content'
+    
+    def wait_ready(self, probe, timeout=30):
+        """
+        Call probe until it stops raising, backing off from 50 ms to 1 s between
+        attempts. Returns False if it still fails after timeout seconds.
+        """
+        delay = 0.05
+        deadline = time.monotonic() + timeout
+        while time.monotonic() < deadline:
+            try:
+                probe()
+                return True
+            except Exception:
+                time.sleep(delay)
+                delay = min(delay * 1.5, 1.0)
+        return False
     
     def start_websocket_server(self):
         """Start WebSocket server in background"""
         try:
             logger.info("Starting WebSocket server...")
             subprocess.Popen([sys.executable, "streaming_server.py"], 
-                           stdout=subprocess.DEVNULL, 
-                           stderr=subprocess.DEVNULL)
+                           stdout=self._devnull, 
+                           stderr=self._devnull)
         except Exception as e:
             logger.error(f"Failed to start WebSocket server: {e}")
     
@@ -369,18 +401,14 @@ def main():
         print("❌ musetalk_wrapper.py not found. Run this script from the streaming system directory.")
         return False
     
-    if not os.path.exists("data/video/yongen.mp4"):
-        print("❌ Test video not found. Make sure you're in the MuseTalk project directory.")
-        print("   Expected: data/video/yongen.mp4")
-        return False
-    
-    if not os.path.exists("data/audio/yongen.wav"):
-        print("❌ Test audio not found. Make sure you're in the MuseTalk project directory.")
-        print("   Expected: data/audio/yongen.wav")
+    try:
+        tester = StreamingSystemTester()
+    except FileNotFoundError as e:
+        print("❌ Test data not found. Make sure you're in the MuseTalk project directory.")
+        print(f"   Expected: {e.filename}")
         return False
     
     # Run tests
-    tester = StreamingSystemTester()
     success = tester.run_all_tests()
     
     return success